@@ -0,0 +1,314 @@
+"""
+SQL query and Redis round-trip budgets of every REST endpoint in api/urls.py.
+
+Each route is requested as a user who owns DOCUMENTS documents, shared with
+ACCESSES_PER_DOCUMENT members each and carrying COMMENTS_PER_DOCUMENT
+comments, and may use at most the queries and Redis round trips declared for
+it in BUDGETS (a pipeline is one round trip). An N+1 introduced anywhere makes
+its endpoint go over budget, since the fixtures are large enough for it to
+show. Raise a budget only together with the change that needs it.
+
+Runs on SQLite with fakeredis in place of Redis:
+
+    python manage.py test api --settings=livedoc.test_settings
+"""
+from unittest import mock
+
+import fakeredis
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ai.views.summarize_document_view import SummarizeDocumentView
+from api import urls
+from document.models import Comment, Document, DocumentAccess, LiveDocumentUser
+from notification.models import Notification
+from user_auth.models import CustomUser
+from utils import document_cache, redis_client
+from utils.redis_key_generator import get_key_for_document, get_key_for_document_user
+
+DOCUMENTS = 100
+MEMBERS = 20
+ACCESSES_PER_DOCUMENT = 5
+COMMENTS_PER_DOCUMENT = 10
+LIVE_USERS_PER_DOCUMENT = 5
+NOTIFICATIONS = 50
+
+PASSWORD = "Secret!Pass1"
+
+# route name -> {method: (max SQL queries, max Redis round trips)}
+BUDGETS = {
+    "api-root": {"GET": (1, 0)},
+    "ping": {"GET": (1, 0)},
+    "test_tok`en": {"GET": (1, 0)},
+    "metrics": {"GET": (0, 1)},
+
+    "register": {"POST": (2, 0)},
+    "login": {"POST": (2, 0)},
+    "logout": {"POST": (1, 0)},
+    "google_login": {"POST": (3, 0)},
+
+    "user_profile_update": {"PATCH": (2, 0)},
+    "user_profile_get": {"GET": (1, 0)},
+    "change_password": {"PUT": (2, 0)},
+    "get_user_by_email": {"GET": (2, 0)},
+    "user_update_profile": {"PATCH": (2, 0)},
+    "get_all_users": {"GET": (2, 0)},
+    "get_users_by_email_list": {"POST": (2, 0)},
+    "get_live_users_emails": {"GET": (1, 2)},
+
+    "document-list": {"GET": (2, 1), "POST": (2, 1)},
+    "document-detail": {"GET": (2, 1), "PATCH": (3, 2), "DELETE": (8, 2)},
+    "document-get-by-share-token": {"GET": (2, 1)},
+    "document-snapshot": {"GET": (6, 0)},
+    "document_access-list": {"GET": (2, 1)},
+    "document_access-detail": {"GET": (2, 1), "PATCH": (3, 1), "DELETE": (3, 0)},
+    "document_access-grant-access": {"POST": (9, 1)},
+    "request_access": {"POST": (9, 1)},
+    "approve_access": {"PATCH": (6, 1)},
+    "revoke_access": {"PATCH": (6, 1)},
+    "live_document_access": {"GET": (2, 0)},
+    "comments": {"GET": (2, 0), "POST": (3, 0)},
+    "comment_update": {"PATCH": (5, 0)},
+    "live_document_users": {"GET": (4, 0)},
+
+    "notification-list": {"GET": (2, 0), "POST": (2, 0)},
+    "notification-detail": {"GET": (2, 0), "PATCH": (3, 0), "DELETE": (3, 0)},
+    "notification-mark-as-read": {"PATCH": (3, 0)},
+    "notification-mark-as-unread": {"PATCH": (3, 0)},
+    "notification-delete-all": {"DELETE": (2, 0)},
+
+    "summarize_document": {"PATCH": (4, 1)},
+    "text_completion": {"POST": (1, 0)},
+    "liveblocks_auth": {"POST": (2, 0)},
+}
+
+
+class CountingRedis(fakeredis.FakeRedis):
+    """fakeredis counting the round trips made through it."""
+    round_trips = 0
+
+    def execute_command(self, *args, **options):
+        self.round_trips += 1
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        def counted_execute(raise_on_error=True):
+            if pipe.command_stack:
+                self.round_trips += 1
+            return execute(raise_on_error)
+
+        pipe.execute = counted_execute
+        return pipe
+
+
+def generated_text(model_response):
+    model = mock.Mock()
+    model.generate_content.return_value.text = model_response
+    return model
+
+
+class EndpointBudgetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = CountingRedis()
+        redis_client.use_clients(cls.redis, fakeredis.aioredis.FakeRedis())
+        cls.addClassCleanup(redis_client.use_clients, None, None)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        password = make_password(PASSWORD)
+        cls.owner = CustomUser.objects.create(
+            email="owner@example.com", password=password, first_name="Owner", last_name="User"
+        )
+        cls.members = CustomUser.objects.bulk_create([
+            CustomUser(email=f"member-{i}@example.com", password=password, first_name="Member", last_name=str(i))
+            for i in range(MEMBERS)
+        ])
+        cls.documents = Document.objects.bulk_create([
+            Document(admin=cls.owner, name=f"Document {i}", content="Lorem ipsum dolor sit amet. " * 40, is_live=i % 2 == 0)
+            for i in range(DOCUMENTS)
+        ])
+        cls.document = cls.documents[0]
+
+        # the last member of each document only asked for access
+        DocumentAccess.objects.bulk_create([
+            DocumentAccess(
+                document=document, user=cls.members[(i + k) % MEMBERS], can_edit=k < ACCESSES_PER_DOCUMENT - 1,
+                access_requested=k == ACCESSES_PER_DOCUMENT - 1, access_approved=k < ACCESSES_PER_DOCUMENT - 1,
+            )
+            for i, document in enumerate(cls.documents) for k in range(ACCESSES_PER_DOCUMENT)
+        ])
+        cls.approved = DocumentAccess.objects.filter(document=cls.document, access_approved=True).first()
+        cls.pending = DocumentAccess.objects.filter(document=cls.document, access_approved=False).first()
+
+        Comment.objects.bulk_create([
+            Comment(document=document, user=cls.members[(i + k) % MEMBERS], content=f"Comment {k}")
+            for i, document in enumerate(cls.documents) for k in range(COMMENTS_PER_DOCUMENT)
+        ])
+        cls.comment = Comment.objects.create(document=cls.document, user=cls.owner, content="My comment")
+
+        live_users = [
+            LiveDocumentUser(
+                document=document, user=cls.members[(i + k) % MEMBERS], email=cls.members[(i + k) % MEMBERS].email,
+                name=f"Member {(i + k) % MEMBERS}", color="#7F63F4", is_online=k % 2 == 0,
+            )
+            for i, document in enumerate(cls.documents) for k in range(LIVE_USERS_PER_DOCUMENT)
+        ]
+        live_users.append(LiveDocumentUser(
+            document=cls.document, user=cls.owner, email=cls.owner.email, name="Owner User", color="#F47F63"
+        ))
+        LiveDocumentUser.objects.bulk_create(live_users)
+
+        cls.notifications = Notification.objects.bulk_create([
+            Notification(recipient=cls.owner, message=f"Notification {i}") for i in range(NOTIFICATIONS)
+        ])
+        cls.foreign = Document.objects.create(admin=cls.members[0], name="Shared with owner", is_live=True)
+
+        # presence of the live documents, as DocumentLiveConsumer leaves it
+        pipe = cls.redis.pipeline(transaction=False)
+        for document in cls.documents:
+            if not document.is_live:
+                continue
+            for live_user in live_users[:LIVE_USERS_PER_DOCUMENT]:
+                pipe.sadd(get_key_for_document(document.share_token), str(live_user.user_id))
+                pipe.hset(get_key_for_document_user(document.share_token, live_user.user_id), mapping={
+                    "first_name": "Member", "last_name": "", "email": live_user.email,
+                    "isOauthVerified": "false", "isActive": "true",
+                })
+        pipe.execute()
+
+    def setUp(self):
+        # handshakes and access checks cache documents per process; every test starts cold
+        document_cache.clear()
+        self.client = APIClient()
+        self.client.cookies["access_token"] = str(AccessToken.for_user(self.owner))
+
+    def request(self, name, method, kwargs=None, query="", data=None, **headers):
+        """Request a route and check it stayed within its budget and succeeded."""
+        max_queries, max_round_trips = BUDGETS[name][method]
+        path = reverse(name, kwargs=kwargs) + query
+        self.redis.round_trips = 0
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method.lower())(path, data, format="json", headers=headers)
+
+        self.assertLess(response.status_code, 300, f"{method} {path}: {response.content[:500]}")
+        self.assertLessEqual(
+            len(queries), max_queries,
+            f"{method} {path} ran {len(queries)} queries, budget {max_queries}:\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries)
+        )
+        self.assertLessEqual(
+            self.redis.round_trips, max_round_trips,
+            f"{method} {path} made {self.redis.round_trips} Redis round trips, budget {max_round_trips}"
+        )
+        return response
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns if pattern.name}
+        self.assertEqual(names - BUDGETS.keys(), set())
+
+    def test_api(self):
+        self.request("api-root", "GET")
+        self.request("test_tok`en", "GET")
+
+    def test_ping(self):
+        # same path as api-root, which the router registers first
+        self.request("ping", "GET")
+
+    @override_settings(METRICS_TOKEN="metrics-secret")
+    def test_metrics(self):
+        self.client.cookies.clear()
+        self.request("metrics", "GET", X_METRICS_TOKEN="metrics-secret")
+
+    def test_auth(self):
+        self.client.cookies.clear()
+        self.request("register", "POST", data={
+            "email": "new@example.com", "password": PASSWORD, "first_name": "New", "last_name": "User",
+        })
+        self.client.cookies.clear()
+        self.request("login", "POST", data={"email": self.owner.email, "password": PASSWORD})
+        self.request("logout", "POST")
+
+    def test_google_login(self):
+        self.client.cookies.clear()
+        user_info = {"email": self.owner.email, "given_name": "Owner", "family_name": "User", "email_verified": True}
+        with mock.patch("user_auth.views.google_oauth_views.id_token.verify_oauth2_token", return_value=user_info):
+            self.request("google_login", "POST", data={"token": "google-id-token"})
+
+    def test_user_profile(self):
+        self.request("user_profile_get", "GET")
+        self.request("user_profile_update", "PATCH", data={"first_name": "Renamed"})
+        self.request("user_update_profile", "PATCH", data={"last_name": "Renamed"})
+        self.request("change_password", "PUT", data={"old_password": PASSWORD, "new_password": "Other!Pass2"})
+
+    def test_users(self):
+        self.request("get_user_by_email", "GET", query=f"?email={self.members[0].email}")
+        self.request("get_all_users", "GET")
+        self.request("get_users_by_email_list", "POST", data={"emails": [member.email for member in self.members]})
+        self.request("liveblocks_auth", "POST", data={"emails": [member.email for member in self.members]})
+
+    def test_live_users(self):
+        self.request("get_live_users_emails", "GET", query=f"?share_token={self.document.share_token}")
+        self.request("live_document_users", "GET", kwargs={"document_id": self.document.id})
+        self.request("live_document_access", "GET", kwargs={"share_token": self.document.share_token})
+
+    def test_documents(self):
+        response = self.request("document-list", "GET")
+        self.assertEqual(len(response.data), DOCUMENTS)
+        response = self.request("document-list", "GET", query="?page_size=20")
+        self.request("document-list", "GET", query="?" + response.data["next"].split("?", 1)[1])
+        self.request("document-list", "POST", data={"name": "New document", "content": "Hello"})
+        self.request("document-detail", "GET", kwargs={"pk": self.document.id})
+        self.request("document-detail", "PATCH", kwargs={"pk": self.document.id}, data={"name": "Renamed"})
+        self.request("document-get-by-share-token", "GET", kwargs={"token": self.document.share_token})
+        self.request("document-snapshot", "GET", kwargs={"token": self.document.share_token})
+        self.request("document-detail", "DELETE", kwargs={"pk": self.document.id})
+
+    def test_document_accesses(self):
+        response = self.request("document_access-list", "GET")
+        self.assertEqual(len(response.data), DOCUMENTS * ACCESSES_PER_DOCUMENT)
+        self.request("document_access-detail", "GET", kwargs={"pk": self.approved.id})
+        self.request("document_access-detail", "PATCH", kwargs={"pk": self.approved.id}, data={"can_edit": False})
+        self.request("document_access-grant-access", "POST", data={
+            "user_id": self.pending.user_id, "document_id": self.document.id,
+        })
+        self.request("document_access-detail", "DELETE", kwargs={"pk": self.approved.id})
+
+    def test_access_requests(self):
+        self.request("request_access", "POST", kwargs={"share_token": self.foreign.share_token})
+        self.request("approve_access", "PATCH", kwargs={"access_id": self.pending.id})
+        self.request("revoke_access", "PATCH", kwargs={"access_id": self.approved.id})
+
+    def test_comments(self):
+        response = self.request("comments", "GET", kwargs={"document_id": self.document.id})
+        self.assertEqual(len(response.data), COMMENTS_PER_DOCUMENT + 1)
+        self.request("comments", "POST", kwargs={"document_id": self.document.id}, data={"content": "Looks good"})
+        self.request("comment_update", "PATCH", kwargs={"pk": self.comment.id}, data={"content": "Edited"})
+
+    def test_notifications(self):
+        notification = self.notifications[0]
+        response = self.request("notification-list", "GET")
+        self.assertEqual(len(response.data), NOTIFICATIONS)
+        self.request("notification-list", "POST", data={"message": "Reminder"})
+        self.request("notification-detail", "GET", kwargs={"pk": notification.id})
+        self.request("notification-detail", "PATCH", kwargs={"pk": notification.id}, data={"type": "warning"})
+        self.request("notification-mark-as-read", "PATCH", kwargs={"pk": notification.id})
+        self.request("notification-mark-as-unread", "PATCH", kwargs={"pk": notification.id})
+        self.request("notification-detail", "DELETE", kwargs={"pk": notification.id})
+        self.request("notification-delete-all", "DELETE")
+
+    def test_ai(self):
+        with mock.patch.object(SummarizeDocumentView, "_model_initialized", True), \
+                mock.patch.object(SummarizeDocumentView, "model", generated_text("A summary."), create=True):
+            self.request("summarize_document", "PATCH", kwargs={"id": self.document.id}, data={"content": "Some text"})
+        with mock.patch("ai.views.text_completion_view.genai.GenerativeModel", return_value=generated_text("more")):
+            self.request("text_completion", "POST", data={"prompt": "Complete this"})
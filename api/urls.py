@@ -14,7 +14,7 @@ from ai.views.text_completion_view import TextCompletionView
 
 from user_auth.views.user_profile_views import UserInfoUpdateView, UserProfileView, PasswordChangeView, \
     GetUserByEmailView, GetAllUsersView, GetUsersFromEmailListView, GetLiveUsersEmailsView
-from .views import ping, test_token
+from .views import ping, test_token, metrics_view
 
 router = DefaultRouter()
 router.register('documents', DocumentViewSet, basename='document')
@@ -24,6 +24,7 @@ router.register('notifications', NotificationViewSet, basename='notification')
 urlpatterns = router.urls + [
     path('', ping, name='ping'),
     path('test-token/', test_token, name='test_tok`en'),
+    path('metrics/', metrics_view, name='metrics'),
 
     path('register/', RegisterApiView.as_view(), name='register'),
     path('login/', LoginAPIView.as_view(), name='login'),
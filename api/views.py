@@ -1,8 +1,12 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import BasePermission, IsAuthenticated
 from rest_framework.response import Response
 
 from user_auth.auth import CookieJwtAuthentication
+from utils import metrics, redis_client
 
 @api_view(['GET'])
 def ping(request):
@@ -23,4 +27,26 @@ def test_token(request):
         "message": "Access token is valid.",
         "user_id": user.id,
         "email": user.email,
-    })
\ No newline at end of file
+    })
+
+
+class CanReadMetrics(BasePermission):
+    """
+    Staff users, or a scraper sending METRICS_TOKEN in the X-Metrics-Token header.
+    """
+    def has_permission(self, request, view):
+        token = request.headers.get("X-Metrics-Token")
+        if settings.METRICS_TOKEN and token and constant_time_compare(token, settings.METRICS_TOKEN):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+@api_view(['GET'])
+@permission_classes([CanReadMetrics])
+def metrics_view(request):
+    """
+    Counters, gauges and histograms of this worker (handshake stages, fan-out,
+    send queues, Redis pools, Yjs rooms, ...) in the Prometheus text format.
+    """
+    metrics.gauge("redis_up").set(1 if redis_client.ping() else 0)
+    return HttpResponse(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
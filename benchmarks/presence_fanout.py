@@ -0,0 +1,184 @@
+"""
+Channel-layer traffic of a burst of users joining one live document.
+
+Connects USERS notification sockets and then USERS DocumentLiveConsumer
+sockets for the same document through an in-memory channel layer that counts
+every group_send and every message it delivers to a channel, both for the
+member-count events alone and for all traffic (which also includes the
+user.joined broadcasts, inherently one per member per join). Redis is
+replaced with fakeredis, and the users and the document are created in a
+throwaway test database (in-memory SQLite under the default
+livedoc.test_settings), which is destroyed afterwards.
+
+Runs once with LIVE_MEMBER_COUNT_WINDOW=0 (every join sends its own count)
+and once with the configured window, and prints what the old per-member
+loop in broadcast_member_count would have cost for reference. Sockets the
+server closed (a failed join, or a client too slow to keep up) are counted
+in the "closed" column rather than ending the run.
+
+Needs fakeredis. Run with:  python -m benchmarks.presence_fanout
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "livedoc.test_settings")
+
+import django
+
+django.setup()
+
+import fakeredis
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+
+from document.models import Document
+from document.routing import websocket_urlpatterns
+from utils import redis_client
+
+USERS = 200
+
+User = get_user_model()
+
+
+COUNT_EVENTS = {"live.member.count", "notify.live.member.count", "notify_live_member_count"}
+
+
+class CountingChannelLayer(InMemoryChannelLayer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.reset()
+
+    def reset(self):
+        # [group_send calls, messages delivered] for member counts and for everything
+        self.counts = [0, 0]
+        self.total = [0, 0]
+
+    async def group_send(self, group, message):
+        members = len(self.groups.get(group, {}))
+        self.total[0] += 1
+        self.total[1] += members
+        if message["type"] in COUNT_EVENTS:
+            self.counts[0] += 1
+            self.counts[1] += members
+        await super().group_send(group, message)
+
+
+class AsUser:
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope["user"] = self.user
+        return await self.app(scope, receive, send)
+
+
+async def connect(app, path):
+    """An open communicator, or None when the server refused the socket."""
+    communicator = WebsocketCommunicator(app, path)
+    connected, _ = await communicator.connect(timeout=30)
+    return communicator if connected else None
+
+
+async def join(app, path):
+    communicator = await connect(app, path)
+    if communicator is None:
+        return None
+    # the consumer accepts first; the user list (or a close, e.g. 4005) comes once it is done joining
+    message = await communicator.receive_output(timeout=30)
+    return None if message["type"] == "websocket.close" else communicator
+
+
+async def drain(communicator):
+    """Read everything sent so far; False when the server closed the socket."""
+    while not await communicator.receive_nothing(timeout=0.01):
+        if (await communicator.receive_output())["type"] == "websocket.close":
+            return False
+    return True
+
+
+def use_fake_redis():
+    server = fakeredis.FakeServer()
+    redis_client.use_clients(fakeredis.FakeRedis(server=server), fakeredis.aioredis.FakeRedis(server=server))
+
+
+async def join_burst(users, document):
+    layer = CountingChannelLayer()
+    channel_layers.backends["default"] = layer
+    use_fake_redis()
+    router = URLRouter(websocket_urlpatterns)
+
+    notifications = [
+        await connect(AsUser(router, user), f"/ws/notifications/{user.id}/") for user in users
+    ]
+    closed = notifications.count(None)
+    layer.reset()
+
+    start = time.perf_counter()
+    sockets = await asyncio.gather(*(
+        join(AsUser(router, user), f"/ws/documents/{document.share_token}/") for user in users
+    ))
+    elapsed = time.perf_counter() - start
+    # let the debounced member counts go out
+    await asyncio.sleep(settings.LIVE_MEMBER_COUNT_WINDOW + 0.5)
+    counts = (list(layer.counts), list(layer.total), elapsed)
+
+    closed += sockets.count(None)
+    for communicator in notifications + sockets:
+        if communicator is None:
+            continue
+        if await drain(communicator):
+            await communicator.disconnect()
+        else:
+            closed += 1
+    return (*counts, closed)
+
+
+def legacy_cost(n):
+    # per join k: one room group_send reaching k sockets, then one group_send per member to their notification group
+    group_sends = sum(1 + k for k in range(1, n + 1))
+    delivered = sum(k + k for k in range(1, n + 1))
+    return [group_sends, delivered]
+
+
+def main():
+    # creating the document already publishes a cache invalidation
+    use_fake_redis()
+    # never the configured database: a fresh one with the schema, shared by every thread
+    database = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        users = [
+            User.objects.create(email=f"presence-bench-{i}@example.com", first_name="Bench", last_name=str(i))
+            for i in range(USERS)
+        ]
+        document = Document.objects.create(admin=users[0], name="presence benchmark", is_live=True)
+        print(f"{USERS} users joining one document")
+        print(f"{'':>28} {'member counts':>23} {'all traffic':>23}")
+        print(
+            f"{'strategy':>28} {'group_send':>11} {'delivered':>11} {'group_send':>11} {'delivered':>11} "
+            f"{'join s':>8} {'closed':>7}"
+        )
+        counts = legacy_cost(USERS)
+        print(
+            f"{'per-member loop (computed)':>28} {counts[0]:>11,} {counts[1]:>11,} {'-':>11} {'-':>11} "
+            f"{'-':>8} {'-':>7}"
+        )
+        for window in (0, settings.LIVE_MEMBER_COUNT_WINDOW):
+            with override_settings(LIVE_MEMBER_COUNT_WINDOW=window):
+                counts, total, elapsed, closed = asyncio.run(join_burst(users, document))
+            print(
+                f"{f'window {window * 1000:.0f}ms':>28} {counts[0]:>11,} {counts[1]:>11,} "
+                f"{total[0]:>11,} {total[1]:>11,} {elapsed:>8.2f} {closed:>7,}"
+            )
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
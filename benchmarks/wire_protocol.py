@@ -0,0 +1,75 @@
+"""
+CPU time and size of the JSON and msgpack wire formats (consumers.wire).
+
+Encodes and decodes typical events of ws/documents/ and ws/notifications/
+with both formats and prints, per event, the median encode and decode time
+and the frame size.
+
+Run with:  python -m benchmarks.wire_protocol
+"""
+import statistics
+import timeit
+
+from consumers.wire import decode_frame, encode_json, encode_msgpack
+
+RUNS = 7
+NUMBER = 20_000
+
+USER = {
+    "id": "42",
+    "name": "Ada Lovelace",
+    "email": "ada@example.com",
+    "color": "#7F63F4",
+    "is_online": True,
+}
+
+EVENTS = {
+    "live_members": {"type": "live_members", "doc_id": 1234, "count": 17},
+    "user_joined": {"type": "user_joined", "user": USER},
+    "new_comment": {
+        "type": "new_comment",
+        "id": 98765,
+        "user": {"email": "ada@example.com", "first_name": "Ada", "last_name": "Lovelace"},
+        "content": "Could we move this paragraph above the table? " * 3,
+        "commented_at": "2025-07-01T12:34:56.789012+00:00",
+    },
+    "notification": {
+        "type": "notification",
+        "payload": {
+            "id": 5555,
+            "message": "Ada Lovelace has requested access to 'Quarterly planning'.",
+            "type": "send.notification",
+            "is_read": False,
+            "created_at": "2025-07-01T12:34:56.789012Z",
+            "recipient": 7,
+        },
+        "doc_id": 1234,
+    },
+    "live_users_list (50)": {
+        "type": "live_users_list",
+        "users": [
+            {"userId": i, "name": f"User {i}", "email": f"user{i}@example.com", "color": "#7F63F4"}
+            for i in range(50)
+        ],
+    },
+}
+
+
+def median_us(fn):
+    return statistics.median(timeit.repeat(fn, number=NUMBER, repeat=RUNS)) / NUMBER * 1e6
+
+
+def main():
+    print(f"{'event':>22} {'format':>8} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for name, event in EVENTS.items():
+        for fmt, encode in (("json", encode_json), ("msgpack", encode_msgpack)):
+            frame = encode(event)
+            data = frame.get("text_data") or frame.get("bytes_data")
+            size = len(data.encode() if isinstance(data, str) else data)
+            encode_us = median_us(lambda: encode(event))
+            decode_us = median_us(lambda: decode_frame(**frame))
+            print(f"{name:>22} {fmt:>8} {size:>7} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
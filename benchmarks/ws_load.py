@@ -0,0 +1,448 @@
+"""
+How many concurrent sockets one worker sustains, per websocket consumer.
+
+Opens CLIENTS simulated clients against DocumentLiveConsumer,
+NotificationConsumer and YjsDocumentConsumer in turn, all on one live
+document, through WebsocketCommunicator with an in-memory channel layer and
+fakeredis in place of Redis. Nothing leaves the process: the users and the
+document are created in a throwaway test database (in-memory SQLite under
+the default livedoc.test_settings), which is destroyed afterwards.
+
+For each consumer it reports:
+
+- connect p50/p99: from the websocket connect until the consumer's first
+  frame (live_users_list, CONNECTED, Yjs sync step 1), with at most
+  CONCURRENCY handshakes in flight
+- broadcast p50/p99: from one event being sent until each socket has it, over
+  ROUNDS broadcasts (a comment posted on the document socket, a member count
+  to the notification sockets, a Yjs update from one editor)
+- messages/s: frames delivered to clients during the broadcast rounds,
+  divided by the time the rounds took
+- memory per connection: growth of the process RSS while the clients were
+  connected, divided by their number
+- layer drops: messages the channel layer dropped because a socket's channel
+  was at capacity (100, as with the Redis layer), over the whole run
+- failed: sockets whose handshake failed (e.g. a connect step timed out) or
+  that the consumer closed later (e.g. as too slow to keep up)
+
+Needs fakeredis and Linux (/proc). Run with:
+
+    python -m benchmarks.ws_load --clients 2000 --consumers document yjs
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "livedoc.test_settings")
+
+import django
+
+django.setup()
+
+import fakeredis
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from pycrdt import Doc, Text, YMessageType, YSyncMessageType, create_update_message
+
+from consumers.fanout import group_send
+from document.models import Document, DocumentAccess
+from document.routing import websocket_urlpatterns
+from utils import redis_client
+from utils.ws_groups import generate_document_counts_group_name, generate_group_name_from_user_id
+
+CLIENTS = 1000
+CONCURRENCY = 100
+ROUNDS = 20
+# generous, so a slow run shows up in the numbers rather than as a timeout
+TIMEOUT = 300
+
+SYNC_UPDATE = bytes([YMessageType.SYNC, YSyncMessageType.SYNC_UPDATE])
+
+User = get_user_model()
+
+
+class CountingChannelLayer(InMemoryChannelLayer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.dropped = 0
+        self._cleaned_at = 0.0
+        # channel -> the task of the application that created it, i.e. a communicator's future
+        self._owners = {}
+
+    def _clean_expired(self):
+        # The in-memory layer scans every channel and group for expired
+        # messages on each send and receive, which with thousands of sockets
+        # costs more than the consumers do. The Redis layer has nothing like
+        # it, so do it at most once a second.
+        now = time.monotonic()
+        if now - self._cleaned_at >= 1:
+            self._cleaned_at = now
+            super()._clean_expired()
+
+    async def send(self, channel, message):
+        try:
+            await super().send(channel, message)
+        except ChannelFull:
+            # group_send drops these silently too; count them instead
+            self.dropped += 1
+
+    async def new_channel(self, prefix="specific."):
+        channel = await super().new_channel(prefix)
+        self._owners[channel] = asyncio.current_task()
+        return channel
+
+    def forget(self, communicator):
+        """Drop the channels of a client's consumer from every group; nobody reads them any more."""
+        for channel in [channel for channel, task in self._owners.items() if task is communicator.future]:
+            del self._owners[channel]
+            self._remove_from_groups(channel)
+            self.channels.pop(channel, None)
+
+    def backlogged(self):
+        """Grouped channels that still hold messages."""
+        grouped = set().union(*self.groups.values())
+        return [channel for channel, queue in list(self.channels.items()) if channel in grouped and not queue.empty()]
+
+
+class AsUser:
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope["user"] = self.user
+        return await self.app(scope, receive, send)
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(values, q):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+class Closed(Exception):
+    """The consumer closed the socket (a failed handshake, a slow client, ...)."""
+
+
+async def receive_frame(communicator):
+    message = await communicator.receive_output(timeout=TIMEOUT)
+    if message["type"] == "websocket.close":
+        raise Closed(message.get("code"))
+    return message["text"] if message.get("text") is not None else message["bytes"]
+
+
+async def drain(communicator):
+    while not await communicator.receive_nothing(timeout=0.05):
+        await receive_frame(communicator)
+
+
+async def disconnect(communicator):
+    """Close a client, giving its consumer's disconnect() as long as it needs, and forget its channel."""
+    await communicator.disconnect(timeout=TIMEOUT)
+    channel_layers["default"].forget(communicator)
+
+
+async def drop_closed(clients):
+    """Read what the clients were sent so far; returns the ones the consumer did not close."""
+    results = await asyncio.gather(*(drain(communicator) for communicator in clients), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(result, Closed):
+            raise result
+    # a consumer that closed stays in its groups until the client side disconnects
+    closed = [communicator for communicator, result in zip(clients, results) if isinstance(result, Closed)]
+    await asyncio.gather(*(disconnect(communicator) for communicator in closed))
+    return [communicator for communicator, result in zip(clients, results) if not isinstance(result, Closed)]
+
+
+async def settle(layer, clients):
+    """Wait for the join traffic (user lists, presence, debounced counts) to be through; returns the clients still open."""
+    await asyncio.sleep(settings.LIVE_MEMBER_COUNT_WINDOW + 0.5)
+    clients = await drop_closed(clients)
+    deadline = time.monotonic() + TIMEOUT
+    while backlogged := layer.backlogged():
+        if time.monotonic() >= deadline:
+            print(f"{len(backlogged)} channels still hold messages after {TIMEOUT}s, e.g. {', '.join(backlogged[:5])}")
+            break
+        await asyncio.sleep(0.1)
+    return await drop_closed(clients)
+
+
+async def receive_matching(communicator, matches):
+    """When the frame that `matches` arrived, or None if the socket was closed first."""
+    try:
+        while True:
+            if matches(await receive_frame(communicator)):
+                return time.perf_counter()
+    except Closed:
+        await disconnect(communicator)
+        return None
+
+
+def is_json_event(frame, **fields):
+    if not isinstance(frame, str):
+        return False
+    data = json.loads(frame)
+    return all(data.get(key) == value for key, value in fields.items())
+
+
+class Scenario:
+    """One consumer under load: where its clients connect and how a broadcast reaches them."""
+    name = None
+
+    def __init__(self, document, users):
+        self.document = document
+        self.users = users
+
+    def path(self, user):
+        raise NotImplementedError
+
+    def ready(self, frame):
+        """Whether the consumer's first frame means the handshake succeeded."""
+        raise NotImplementedError
+
+    async def prepare(self, clients):
+        pass
+
+    def listeners(self, clients):
+        return clients
+
+    async def broadcast(self, clients, round_number):
+        raise NotImplementedError
+
+    def matches(self, frame, round_number):
+        raise NotImplementedError
+
+
+class DocumentScenario(Scenario):
+    name = "document"
+
+    def path(self, user):
+        return f"/ws/documents/{self.document.share_token}/"
+
+    def ready(self, frame):
+        return is_json_event(frame, type="live_users_list")
+
+    async def broadcast(self, clients, round_number):
+        # a comment, as the frontend posts it after creating one through the API
+        await clients[0].send_to(text_data=json.dumps({
+            "type": "comment",
+            "comment": {
+                "id": round_number,
+                "user": {"email": self.users[0].email, "first_name": "Load", "last_name": "Test"},
+                "content": "Could we move this paragraph above the table?",
+                "commented_at": "2025-07-01T12:34:56.789012+00:00",
+            },
+        }))
+
+    def matches(self, frame, round_number):
+        return is_json_event(frame, type="new_comment", id=round_number)
+
+
+class NotificationScenario(Scenario):
+    name = "notification"
+
+    def path(self, user):
+        return f"/ws/notifications/{user.id}/"
+
+    def ready(self, frame):
+        return is_json_event(frame, type="CONNECTED")
+
+    async def prepare(self, clients):
+        # what DocumentLiveConsumer does for each member, without the document sockets
+        layer = channel_layers["default"]
+        for user in self.users:
+            await layer.group_send(
+                generate_group_name_from_user_id(user.id),
+                {"type": "watch.document", "share_token": str(self.document.share_token)}
+            )
+
+    async def broadcast(self, clients, round_number):
+        await group_send(
+            channel_layers["default"],
+            generate_document_counts_group_name(self.document.share_token),
+            {
+                "type": "notify.live.member.count",
+                "message": f"Live member count updated to {round_number}",
+                "doc_id": self.document.id,
+                "count": round_number,
+            }
+        )
+
+    def matches(self, frame, round_number):
+        return is_json_event(frame, type="LIVE_MEMBER_COUNT", count=round_number)
+
+
+class YjsScenario(Scenario):
+    name = "yjs"
+
+    def __init__(self, document, users):
+        super().__init__(document, users)
+        self.doc = Doc()
+        self.text = self.doc.get("body", type=Text)
+        self.updates = []
+        self.doc.observe(lambda event: self.updates.append(event.update))
+
+    def path(self, user):
+        return f"/ws/yjs-server/{self.document.share_token}"
+
+    def ready(self, frame):
+        return isinstance(frame, bytes)
+
+    def listeners(self, clients):
+        # the room does not echo an update back to the socket it came from
+        return clients[1:]
+
+    async def broadcast(self, clients, round_number):
+        self.text += f"edit {round_number} "
+        await clients[0].send_to(bytes_data=create_update_message(self.updates[-1]))
+
+    def matches(self, frame, round_number):
+        return isinstance(frame, bytes) and frame[:2] == SYNC_UPDATE
+
+
+async def open_client(scenario, router, user, semaphore):
+    async with semaphore:
+        communicator = WebsocketCommunicator(AsUser(router, user), scenario.path(user))
+        start = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=TIMEOUT)
+        if connected:
+            try:
+                # the first frame means the consumer is done with its handshake
+                if scenario.ready(await receive_frame(communicator)):
+                    return communicator, time.perf_counter() - start
+            except Closed:
+                pass
+        # refused, or an error frame before closing: counted as failed
+        await disconnect(communicator)
+        return None, time.perf_counter() - start
+
+
+async def run(scenario, concurrency, rounds):
+    layer = channel_layers["default"]
+    layer.dropped = 0
+    router = URLRouter(websocket_urlpatterns)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    gc.collect()
+    rss_before = rss_bytes()
+    opened = await asyncio.gather(*(open_client(scenario, router, user, semaphore) for user in scenario.users))
+    clients = [communicator for communicator, _ in opened if communicator is not None]
+    connect_times = [elapsed for communicator, elapsed in opened if communicator is not None]
+
+    await scenario.prepare(clients)
+    clients = await settle(layer, clients)
+    gc.collect()
+    rss_after = rss_bytes()
+
+    listeners = scenario.listeners(clients)
+    latencies, busy = [], 0.0
+    for round_number in range(1, rounds + 1):
+        receivers = [
+            asyncio.create_task(receive_matching(communicator, lambda frame, n=round_number: scenario.matches(frame, n)))
+            for communicator in listeners
+        ]
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await scenario.broadcast(clients, round_number)
+        received = await asyncio.gather(*receivers)
+        latencies.extend(at - start for at in received if at is not None)
+        busy += max((at for at in received if at is not None), default=start) - start
+        listeners = [communicator for communicator, at in zip(listeners, received) if at is not None]
+
+    still_open = set(listeners) | set(clients[:1])
+    # done before the next scenario, so its settle() does not wait on this one's leave traffic
+    await asyncio.gather(*(disconnect(communicator) for communicator in still_open))
+    return {
+        "failed": len(scenario.users) - len(still_open),
+        "connect": connect_times,
+        "broadcast": latencies,
+        "rate": len(latencies) / busy if busy else 0.0,
+        "memory": (rss_after - rss_before) / max(len(clients), 1),
+        "dropped": layer.dropped,
+    }
+
+
+def use_local_backends():
+    # Under a join burst messages can sit in a socket's channel for longer than
+    # the default expiry of 60s, and the in-memory layer then also drops that
+    # socket from all of its groups (the Redis layer does not), so it would
+    # silently miss every broadcast after.
+    channel_layers.backends["default"] = CountingChannelLayer(expiry=TIMEOUT)
+    server = fakeredis.FakeServer()
+    redis_client.use_clients(fakeredis.FakeRedis(server=server), fakeredis.aioredis.FakeRedis(server=server))
+
+
+async def run_all(scenarios, concurrency, rounds):
+    results = []
+    for scenario in scenarios:
+        results.append((scenario, await run(scenario, concurrency, rounds)))
+    return results
+
+
+def create_fixtures(clients):
+    User.objects.bulk_create([
+        User(email=f"ws-load-{i}@example.com", first_name="Load", last_name=str(i))
+        for i in range(clients)
+    ])
+    users = list(User.objects.filter(email__startswith="ws-load-").order_by("id"))
+    document = Document.objects.create(admin=users[0], name="websocket load test", is_live=True)
+    # everyone edits, so Yjs updates reach all sockets straight away rather than as viewer batches
+    DocumentAccess.objects.bulk_create([
+        DocumentAccess(document=document, user=user, can_edit=True, access_approved=True)
+        for user in users[1:]
+    ])
+    return document, users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=CLIENTS)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="handshakes in flight at once")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="broadcasts measured per consumer")
+    parser.add_argument(
+        "--consumers", nargs="+", choices=["document", "notification", "yjs"],
+        default=["document", "notification", "yjs"],
+    )
+    args = parser.parse_args()
+
+    use_local_backends()
+    # never the configured database: a fresh one with the schema, shared by every thread
+    database = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        document, users = create_fixtures(args.clients)
+        kinds = {"document": DocumentScenario, "notification": NotificationScenario, "yjs": YjsScenario}
+        scenarios = [kinds[name](document, users) for name in args.consumers]
+        results = asyncio.run(run_all(scenarios, args.concurrency, args.rounds))
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+
+    print(f"{args.clients} clients, {args.concurrency} handshakes at a time, {args.rounds} broadcasts")
+    print(
+        f"{'consumer':>12} {'connect p50':>12} {'connect p99':>12} {'bcast p50':>10} {'bcast p99':>10} "
+        f"{'msgs/s':>10} {'KiB/conn':>9} {'layer drops':>12} {'failed':>7}"
+    )
+    for scenario, result in results:
+        print(
+            f"{scenario.name:>12} "
+            f"{percentile(result['connect'], 50) * 1000:>10.1f}ms {percentile(result['connect'], 99) * 1000:>10.1f}ms "
+            f"{percentile(result['broadcast'], 50) * 1000:>8.1f}ms {percentile(result['broadcast'], 99) * 1000:>8.1f}ms "
+            f"{result['rate']:>10,.0f} {result['memory'] / 1024:>9.1f} {result['dropped']:>12,} {result['failed']:>7,}"
+        )
+
+
+if __name__ == "__main__":
+    main()
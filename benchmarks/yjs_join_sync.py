@@ -0,0 +1,76 @@
+"""
+Join cost of a reconnecting Yjs client, for 1 MB and 10 MB documents.
+
+Compares what YjsDocumentConsumer can send a client that already holds most
+of the document:
+
+- full state: the whole document, as if the client had no state vector
+- room diff: load the stored state into a Doc, then diff against the client's
+  state vector (the join path)
+
+Run with:  python -m benchmarks.yjs_join_sync
+"""
+import statistics
+import time
+
+from pycrdt import Doc, Text, get_state
+
+SIZES = [1_000_000, 10_000_000]
+# edits the reconnecting client missed while it was offline
+MISSED_EDITS = 50
+RUNS = 5
+
+
+def build_document(target_size):
+    """A stored document of roughly target_size bytes, plus the state vector of a client that is slightly behind."""
+    doc = Doc()
+    text = doc.get("body", type=Text)
+    chunk = "lorem ipsum dolor sit amet " * 40
+
+    while len(doc.get_update()) < target_size:
+        with doc.transaction():
+            for _ in range(1000):
+                text += chunk
+            # some deletions, so the encoding carries tombstones like a real document
+            del text[len(text) // 3:len(text) // 3 + 500]
+
+    client_state = doc.get_state()
+    for i in range(MISSED_EDITS):
+        text.insert(len(text) // 2, f"missed edit {i} ")
+
+    return doc.get_update(), client_state
+
+
+def measure(fn):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        payload = fn()
+        timings.append(time.perf_counter() - start)
+    return len(payload), statistics.median(timings) * 1000
+
+
+def full_state(stored, client_state):
+    doc = Doc()
+    doc.apply_update(stored)
+    return doc.get_update()
+
+
+def room_diff(stored, client_state):
+    doc = Doc()
+    doc.apply_update(stored)
+    return doc.get_update(client_state)
+
+
+def main():
+    print(f"{'document':>10} {'strategy':>12} {'bytes sent':>12} {'join ms':>10}")
+    for size in SIZES:
+        stored, client_state = build_document(size)
+        assert get_state(stored) != client_state
+        for name, strategy in [("full state", full_state), ("room diff", room_diff)]:
+            sent, ms = measure(lambda: strategy(stored, client_state))
+            print(f"{len(stored) / 1e6:>8.1f}MB {name:>12} {sent:>12,} {ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,139 @@
-import json
-import random
 import asyncio
+import logging
 
-from redis.asyncio import Redis
 from channels.exceptions import DenyConnection
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
 from asgiref.sync import sync_to_async
-from document.models import Document, LiveDocumentUser, USER_COLORS
+from document.models import Document, LiveDocumentUser
+from consumers.fanout import encode_once, group_send
+from consumers.handshake import HandshakeTimingMixin
+from consumers.send_queue import BoundedSendMixin
+from consumers.wire import WireProtocolMixin
+from utils import live_users, presence
+from utils.redis_client import get_async_redis
+from utils.document_cache import get_document_info
 from utils.redis_key_generator import get_key_for_document
 from django.conf import settings
 
-from utils.ws_groups import generate_group_name_from_user_id
+from utils.ws_groups import generate_group_name_from_user_id, generate_document_counts_group_name
+
+logger = logging.getLogger(__name__)
+
+
+async def send_member_count(channel_layer, share_token, doc_id, count):
+    await group_send(
+        channel_layer,
+        f"doc_{share_token}",
+        {
+            "type": "live.member.count",
+            "doc_id": doc_id,
+            "count": count,
+        }
+    )
+
+    # Notification sockets of the members (see watch.document), in one message
+    await group_send(
+        channel_layer,
+        generate_document_counts_group_name(share_token),
+        {
+            "type": "notify.live.member.count",
+            "message": f"Live member count updated to {count}",
+            "doc_id": doc_id,
+            "count": count,
+        }
+    )
+
+
+# Member counts waiting to be sent, per share token. However many users join or
+# leave a document within LIVE_MEMBER_COUNT_WINDOW, its count goes out once.
+_pending_counts = {}
+
+def schedule_member_count(channel_layer, share_token, doc_id):
+    if share_token not in _pending_counts:
+        _pending_counts[share_token] = asyncio.create_task(
+            _send_member_count_later(channel_layer, share_token, doc_id)
+        )
+
+
+async def _send_member_count_later(channel_layer, share_token, doc_id):
+    try:
+        await asyncio.sleep(settings.LIVE_MEMBER_COUNT_WINDOW)
+    finally:
+        # changes from here on schedule the next send
+        del _pending_counts[share_token]
 
+    try:
+        count = await presence.count(await get_async_redis(), share_token)
+        await send_member_count(channel_layer, share_token, doc_id, count)
+    except Exception:
+        logger.exception("Could not send the member count of document %s", share_token)
 
-_redis_client = None
 
-async def get_shared_redis():
-    global _redis_client
-    if _redis_client is None:
-        _redis_client = await Redis.from_url(settings.REDIS_URL)
-    return _redis_client
+# Presence entries of connections whose worker died are not removed by any
+# disconnect(); every worker runs this loop and removes the ones whose
+# heartbeat stopped, telling the room as if the user had left.
+_reaper = None
 
+def start_presence_reaper():
+    global _reaper
+    if _reaper is None or _reaper.done():
+        _reaper = asyncio.create_task(_reap_loop())
 
-class DocumentLiveConsumer(AsyncWebsocketConsumer):
+
+async def _reap_loop():
+    while True:
+        await asyncio.sleep(settings.PRESENCE_REAP_INTERVAL)
+        try:
+            await reap_presence(get_channel_layer())
+        except Exception:
+            logger.exception("Could not reap expired presence")
+
+
+async def reap_presence(channel_layer):
+    redis = await get_async_redis()
+    for share_token, user_id in await presence.expired(redis):
+        details = await presence.reap(redis, share_token, user_id)
+        if details is None:
+            continue  # another worker got it
+
+        doc_id = await _mark_user_offline(share_token, user_id)
+        await live_users.mark_offline(redis, share_token, user_id)
+        # none of the user's sockets in the document renewed the deadline, so
+        # all are gone; one whose heartbeat was only late watches again on its next beat
+        await channel_layer.group_send(
+            generate_group_name_from_user_id(user_id),
+            {"type": "unwatch.document", "share_token": share_token}
+        )
+        await group_send(
+            channel_layer,
+            f"doc_{share_token}",
+            {
+                "type": "user.left",
+                "user": {
+                    "id": str(user_id),
+                    "first_name": details.get("first_name", ""),
+                    "last_name": details.get("last_name", ""),
+                    "name": f"{details.get('first_name', '')} {details.get('last_name', '')}",
+                    "email": details.get("email", ""),
+                    "is_online": False,
+                }
+            }
+        )
+        if doc_id is not None:
+            schedule_member_count(channel_layer, share_token, doc_id)
+
+
+@sync_to_async
+def _mark_user_offline(share_token, user_id):
+    LiveDocumentUser.objects.filter(document__share_token=share_token, user_id=user_id).update(is_online=False)
+    try:
+        return get_document_info(share_token).id
+    except Document.DoesNotExist:
+        return None
+
+
+class DocumentLiveConsumer(HandshakeTimingMixin, WireProtocolMixin, BoundedSendMixin, AsyncWebsocketConsumer):
     async def connect(self):
         # Basic auth check early
         if not self.scope.get("user") or self.scope["user"] is None:
@@ -34,13 +145,12 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
         self.group_name = f"doc_{self.share_token}"
 
         # Accept early so handshake completes fast
-        await self.accept()
+        await self.handshake_stage("accept", self.accept())
 
-        # Fetch dependencies with timeouts
+        # Fetch dependencies with timeouts; each stage is timed (see HandshakeTimingMixin)
         try:
-            self.document = await asyncio.wait_for(
-                sync_to_async(Document.objects.get)(share_token=self.share_token),
-                timeout=3.0
+            self.document = await self.handshake_stage(
+                "document", sync_to_async(get_document_info)(self.share_token), timeout=3.0
             )
         except (asyncio.TimeoutError, Document.DoesNotExist) as e:
             await self.send_json({"type": "error", "message": "Unable to load document."})
@@ -48,12 +158,12 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
             return
 
         try:
-            self.is_admin = await asyncio.wait_for(self.is_user_admin(), timeout=1.0)
+            self.is_admin = await self.handshake_stage("admin_check", self.is_user_admin(), timeout=1.0)
         except asyncio.TimeoutError:
             self.is_admin = False  # fail safe
 
         try:
-            self.redis = await get_shared_redis()
+            self.redis = await self.handshake_stage("redis", get_async_redis())
         except Exception as e:
             await self.send_json({"type": "error", "message": "Realtime backend unavailable."})
             await self.close(code=4004)
@@ -69,46 +179,87 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
             await self.close(code=4002)
             return
 
-        # Add user to live document (with timeout)
+        # Add user to live document (with timeout); only a first join goes to the database
         try:
-            live_user = await asyncio.wait_for(self.add_user_to_live_document(), timeout=2.0)
+            self.live_entry, users = await self.handshake_stage(
+                "live_users", live_users.join(self.redis, self.document, self.user), timeout=2.0
+            )
         except asyncio.TimeoutError:
             await self.send_json({"type": "error", "message": "Failed to add user."})
             await self.close(code=4005)
             return
 
+        self.presence_details = {
+            "id": str(self.user.id),
+            "first_name": self.user.first_name,
+            "last_name": self.user.last_name,
+            "email": self.user.email,
+            "color": self.live_entry["color"]
+        }
         try:
-            await self.redis.sadd(self.redis_document_key, str(self.user.id))
-            await self.redis.hset(
-                f"doc:{self.share_token}:user:{self.user.id}",
-                mapping={
-                    "id": str(self.user.id),
-                    "first_name": self.user.first_name,
-                    "last_name": self.user.last_name,
-                    "email": self.user.email,
-                    "color": live_user.color
-                }
+            await self.handshake_stage(
+                "presence", presence.join(
+                    self.redis, self.share_token, self.user.id, self.presence_details, self.channel_name
+                )
             )
         except Exception as e: pass
 
+        # keep the presence entry alive for as long as this socket is
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        start_presence_reaper()
+
+        await self.handshake_stage("groups", self._join_groups())
+        await self.handshake_stage("broadcasts", self._announce_join(users))
+
+    async def _join_groups(self):
         await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self._watch_document()
 
-        await self.send_live_users_list()
-        await self._broadcast_user_joined(live_user)
-        await self.broadcast_member_count()
+    async def _watch_document(self):
+        # have the user's notification socket follow this document's member count
+        await self.channel_layer.group_send(
+            generate_group_name_from_user_id(self.user.id),
+            {"type": "watch.document", "share_token": str(self.share_token)}
+        )
 
+    async def _announce_join(self, users):
+        await self.send_live_users_list(users)
+        await self._broadcast_user_joined()
+        self.broadcast_member_count()
+
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                reaped = await presence.heartbeat(
+                    self.redis, self.share_token, self.user.id, self.presence_details, self.channel_name
+                )
+                if reaped:
+                    # the reaper took this socket for dead and told everyone the user left
+                    self.live_entry, _ = await live_users.join(self.redis, self.document, self.user)
+                    await self._watch_document()
+                    await self._broadcast_user_joined()
+                    self.broadcast_member_count()
+            except Exception:
+                logger.exception("Could not renew presence of user %s in document %s", self.user.id, self.share_token)
 
     async def disconnect(self, close_code):
+        if getattr(self, "_heartbeat", None) is not None:
+            self._heartbeat.cancel()
+
         if hasattr(self, "user") and hasattr(self, "share_token") and hasattr(self, "redis"):
-            # Mark user as offline in the database
-            await self.mark_user_offline()
             try:
-                await self.redis.srem(get_key_for_document(self.share_token), str(self.user.id))
-                await self.redis.delete(f"doc:{self.share_token}:user:{self.user.id}")
+                # Mark user as offline (the database follows in the next batch)
+                if hasattr(self, "live_entry"):
+                    await live_users.leave(self.redis, self.share_token, self.live_entry)
+
+                remaining_count, sockets = await presence.leave(
+                    self.redis, self.share_token, self.user.id, self.channel_name
+                )
 
                 # Send live count directly to disconnecting user (required for updating states)
                 disconnecting_user_id = self.user.id
-                remaining_count = await self.redis.scard(self.redis_document_key)
 
                 await self.channel_layer.group_send(
                     generate_group_name_from_user_id(disconnecting_user_id),
@@ -119,9 +270,16 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
                         "message": f"Live member count updated to {remaining_count}"
                     }
                 )
+                if not sockets:
+                    # the user's last socket in this document
+                    await self.channel_layer.group_send(
+                        generate_group_name_from_user_id(disconnecting_user_id),
+                        {"type": "unwatch.document", "share_token": str(self.share_token)}
+                    )
 
                 # Broadcast user left
-                await self.channel_layer.group_send(
+                await group_send(
+                    self.channel_layer,
                     self.group_name,
                     {
                         "type": "user.left",
@@ -136,7 +294,7 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
                     }
                 )
 
-                await self.broadcast_member_count()
+                self.broadcast_member_count()
             except Exception as e:
                 print(f"Redis cleanup error: {e}")
 
@@ -144,16 +302,16 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
-        if text_data:
-            await self.receive_text_data(text_data)
+        if text_data or bytes_data:
+            await self.receive_event(self.decode_event(text_data, bytes_data))
 
-    async def receive_text_data(self, text_data):
-        data = json.loads(text_data)
+    async def receive_event(self, data):
         message_type = data.get("type")
 
         if message_type == "comment":
             comment_data = data.get("comment")
-            await self.channel_layer.group_send(
+            await group_send(
+                self.channel_layer,
                 self.group_name,
                 {
                     "type": "broadcast.comment",
@@ -166,7 +324,7 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
             )
 
     async def broadcast_comment(self, event):
-        await self.send(text_data=json.dumps({
+        await self.queue_send(**encode_once(self, event, lambda: {
             "type": "new_comment" if event["action"] == "create" else "update_comment",
             "id": event["id"],
             "user": event["user"],
@@ -174,60 +332,47 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
             "commented_at": event["commented_at"]
         }))
 
-    async def broadcast_member_count(self):
-        count = await self.redis.scard(self.redis_document_key)
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "live.member.count",
-                "doc_id": self.document.id,
-                "count": count,
-            }
-        )
-
-        # Notify all present users individually
-        user_ids = await self.redis.smembers(self.redis_document_key)
-        for user_id_bytes in user_ids:
-            user_id = int(user_id_bytes.decode("utf-8"))
-
-            await self.channel_layer.group_send(
-                generate_group_name_from_user_id(user_id),  # Send to NotificationConsumer
-                {
-                    "type": "notify.live.member.count",
-                    "message": f"Live member count updated to {count}",
-                    "doc_id": self.document.id,
-                    "count": count,
-                }
-            )
+    def broadcast_member_count(self):
+        schedule_member_count(self.channel_layer, self.share_token, self.document.id)
 
     async def live_member_count(self, event):
-        await self.send(text_data=json.dumps({
+        await self.queue_send(**encode_once(self, event, lambda: {
             "type": "live_members",
-            "doc_id": self.document.id,
+            "doc_id": event["doc_id"],
             "count": event["count"],
-        }))
+        }), coalesce_key="live_members")
 
-    async def send_live_users_list(self):
-        live_users = await self.get_all_live_users()
-        await self.send(text_data=json.dumps({
+    async def send_live_users_list(self, users):
+        # formatting for frontend
+        await self.queue_send(**self.encode_event({
             "type": "live_users_list",
-            "users": list(live_users)
-        }))
+            "users": [
+                {
+                    "userId": user["user_id"],
+                    "name": user["name"],
+                    "email": user["email"],
+                    "color": user["color"]
+                }
+                for user in users
+            ]
+        }), coalesce_key="live_users_list")
 
     async def user_joined(self, event):
-        await self.send(text_data=json.dumps({
+        # a later join/leave of the same user supersedes this one
+        await self.queue_send(**encode_once(self, event, lambda: {
             "type": "user_joined",
             "user": event["user"]
-        }))
+        }), coalesce_key=f"presence:{event['user']['id']}")
 
     async def user_left(self, event):
-        await self.send(text_data=json.dumps({
+        await self.queue_send(**encode_once(self, event, lambda: {
             "type": "user_left",
             "user": event["user"]
-        }))
+        }), coalesce_key=f"presence:{event['user']['id']}")
 
-    async def _broadcast_user_joined(self, live_user):
-        await self.channel_layer.group_send(
+    async def _broadcast_user_joined(self):
+        await group_send(
+            self.channel_layer,
             self.group_name,
             {
                 "type": "user.joined",
@@ -235,79 +380,23 @@ class DocumentLiveConsumer(AsyncWebsocketConsumer):
                     "id": str(self.user.id),
                     "name": f"{self.user.first_name} {self.user.last_name}",
                     "email": self.user.email,
-                    "color": live_user.color,
+                    "color": self.live_entry["color"],
                     "is_online": True,
                 }
             }
         )
 
     async def send_json(self, content):
-        await self.send(text_data=json.dumps(content))
-
-    @sync_to_async()
-    def mark_user_offline(self):
-        try:
-            live_user = LiveDocumentUser.objects.get(document=self.document, user=self.user)
-            live_user.is_online = False
-            live_user.save()
-        except LiveDocumentUser.DoesNotExist:
-            pass
-
-    @sync_to_async
-    def add_user_to_live_document(self):
-        live_user, created = LiveDocumentUser.objects.get_or_create(
-            document=self.document,
-            user=self.user,
-            defaults={
-                'email': self.user.email,
-                'name': f'{self.user.first_name} {self.user.last_name}' or self.user.email,
-                'color': random.choice(USER_COLORS),
-                'is_online': True,
-            }
-        )
-
-        if not created:
-            # Update the existing record
-            live_user.email = self.user.email
-            live_user.name = f'{self.user.first_name} {self.user.last_name}' or self.user.email
-            live_user.is_online = True  # or False, depending on your logic
-            # Optionally update color if you want
-            # live_user.color = random.choice(USER_COLORS)
-            live_user.save()
-
-        return live_user
-
-    @sync_to_async
-    def _remove_user_from_live_document(self):
-        LiveDocumentUser.objects.filter(document=self.document, user=self.user).delete()
-
+        await self.send(**self.encode_event(content))
 
     @sync_to_async
     def is_user_admin(self):
         return self.document.admin_id == self.user.id
 
-    @sync_to_async
-    def get_all_live_users(self):
-        users = LiveDocumentUser.objects.filter(document=self.document).values(
-            "user_id", "name", "email", "color"
-        )
-        # formatting for frontend
-        formatted_users = [
-            {
-                "userId": user["user_id"],
-                "name": user["name"],
-                "email": user["email"],
-                "color": user["color"]
-            }
-            for user in users
-        ]
-
-        return list(formatted_users)
-
     async def check_user(self):
         if "user" not in self.scope or self.scope["user"] is None:
             await self.accept()
-            await self.send(json.dumps({
+            await self.send(**self.encode_event({
                 "error": "unauthorized",
                 "message": "User is not logged in"
             }))
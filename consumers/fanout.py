@@ -0,0 +1,39 @@
+"""
+Encode-once delivery of group events.
+
+group_send() stamps every event with an event_id. When the event reaches
+many consumers of the same process, the first one builds and encodes the
+outgoing frame through encode_once() and the others reuse those bytes
+instead of building the same payload and calling json.dumps again.
+
+Only for events whose frame is the same for every recipient of the group.
+"""
+import uuid
+
+from cachetools import TTLCache
+
+from utils import metrics
+
+# (event_id, msgpack?) -> send() kwargs; only needs to live while an event is being delivered
+_frames = TTLCache(maxsize=4096, ttl=30)
+
+
+async def group_send(channel_layer, group, event):
+    event["event_id"] = uuid.uuid4().hex
+    await channel_layer.group_send(group, event)
+
+
+def encode_once(consumer, event, build):
+    """The frame of a group event in the consumer's wire format; `build` returns its payload."""
+    event_id = event.get("event_id")
+    if event_id is None:
+        return consumer.encode_event(build())
+
+    key = (event_id, consumer.use_msgpack)
+    frame = _frames.get(key)
+    if frame is None:
+        frame = _frames[key] = consumer.encode_event(build())
+        metrics.counter("ws_fanout_encoded_total").inc()
+    else:
+        metrics.counter("ws_fanout_reused_total").inc()
+    return frame
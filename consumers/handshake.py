@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from channels.exceptions import DenyConnection
+
+from utils import metrics
+
+
+class HandshakeTimingMixin:
+    """
+    Timing of a websocket consumer's connect(), per stage.
+
+    connect() runs each of its steps through handshake_stage(), which records
+    how long the step took in ws_handshake_stage_seconds{consumer, stage} and
+    counts steps that hit their timeout (ws_handshake_timeouts_total) or
+    raised anything but DenyConnection (ws_handshake_errors_total). The whole
+    connect() goes into ws_handshake_seconds{consumer}. Exceptions are passed on unchanged, so
+    each consumer still decides how a failed step ends the handshake.
+    """
+
+    async def handshake_stage(self, stage, awaitable, timeout=None):
+        labels = {"consumer": type(self).__name__, "stage": stage}
+        start = time.perf_counter()
+        try:
+            if timeout is None:
+                return await awaitable
+            return await asyncio.wait_for(awaitable, timeout=timeout)
+        except asyncio.TimeoutError:
+            metrics.counter("ws_handshake_timeouts_total", **labels).inc()
+            raise
+        except (asyncio.CancelledError, DenyConnection):
+            raise
+        except Exception:
+            metrics.counter("ws_handshake_errors_total", **labels).inc()
+            raise
+        finally:
+            metrics.histogram("ws_handshake_stage_seconds", **labels).observe(time.perf_counter() - start)
+
+    async def websocket_connect(self, message):
+        start = time.perf_counter()
+        try:
+            await super().websocket_connect(message)
+        finally:
+            metrics.histogram(
+                "ws_handshake_seconds", consumer=type(self).__name__
+            ).observe(time.perf_counter() - start)
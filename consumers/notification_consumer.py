@@ -1,27 +1,35 @@
-import json
+import logging
 
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.exceptions import DenyConnection
 from django.template.defaulttags import ifchanged
 
+from consumers.fanout import encode_once
+from consumers.handshake import HandshakeTimingMixin
+from consumers.send_queue import BoundedSendMixin
+from consumers.wire import WireProtocolMixin
 from notification.serializers import NotificationSerializer
-from utils.ws_groups import generate_group_name_from_user_id
+from utils import presence
+from utils.redis_client import get_async_redis
+from utils.ws_groups import generate_group_name_from_user_id, generate_document_counts_group_name
 from django.contrib.auth import get_user_model
 
 from notification.models import Notification
 
+logger = logging.getLogger(__name__)
+
 User = get_user_model()
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(HandshakeTimingMixin, WireProtocolMixin, BoundedSendMixin, AsyncWebsocketConsumer):
     async def connect(self):
         # Check user authentication
-        await self.check_user()
+        await self.handshake_stage("auth", self.check_user())
 
         # check if the user_id in the URL matches the authenticated user
         if self.scope["user"].id != int(self.scope["url_route"]["kwargs"]["user_id"]) :
             await self.accept()
-            await self.send(json.dumps({
+            await self.send(**self.encode_event({
                 "error": "unauthorized",
                 "message": "User ID does not match authenticated user"
             }))
@@ -31,25 +39,28 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         # now we have authentication suer and can access user information by scope["user"]
         user = self.scope["user"]
         self.user_group_name = generate_group_name_from_user_id(user.id)
+        # member-count groups of the live documents the user is in
+        self.watched_groups = set()
 
-        await self.accept()
+        await self.handshake_stage("accept", self.accept())
 
         # Add user to their notification group
-        await self.channel_layer.group_add(
+        await self.handshake_stage("groups", self.channel_layer.group_add(
             self.user_group_name,
             self.channel_name
-        )
+        ))
+        await self.handshake_stage("watch", self.watch_live_documents(user.id))
 
-        await self.send(text_data=json.dumps({
+        await self.handshake_stage("welcome", self.send(**self.encode_event({
             "type": "CONNECTED",
             "message": "Connected to user notification channel"
-        }))
+        })))
 
 
     async def check_user(self):
         if "user" not in self.scope or self.scope["user"] is None:
             await self.accept()  # Accept to send the error message
-            await self.send(json.dumps({
+            await self.send(**self.encode_event({
                 "error": "unauthorized",
                 "message": "User is not logged in"
             }))
@@ -61,6 +72,8 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.user_group_name,
                 self.channel_name
             )
+        for group in getattr(self, "watched_groups", ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
         await self.close()
 
     # FUNCTION TO SEND NOTIFICATIONS TO THE USER
@@ -90,16 +103,38 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         if "access_obj" in event:
             payload["access_obj"] = event["access_obj"]
 
-        await self.send(text_data=json.dumps(payload))
+        await self.queue_send(**self.encode_event(payload))
 
     async def notify_live_member_count(self, event):
         # Send live member count to the user
-        await self.send(text_data=json.dumps({
+        await self.queue_send(**encode_once(self, event, lambda: {
             "type": "LIVE_MEMBER_COUNT",
             "doc_id": event["doc_id"],
             "count": event["count"],
             "message": event["message"],
-        }))
+        }), coalesce_key=f"live_members:{event['doc_id']}")
+
+    async def watch_live_documents(self, user_id):
+        # documents the user joined before this socket connected, e.g. on a reconnect;
+        # joins from now on arrive as watch.document through the user group
+        try:
+            share_tokens = await presence.documents(await get_async_redis(), user_id)
+        except Exception:
+            logger.exception("Could not load the live documents of user %s", user_id)
+            return
+        for share_token in share_tokens:
+            await self.watch_document({"share_token": share_token})
+
+    async def watch_document(self, event):
+        # sent by DocumentLiveConsumer when the user joins a live document
+        group = generate_document_counts_group_name(event["share_token"])
+        self.watched_groups.add(group)
+        await self.channel_layer.group_add(group, self.channel_name)
+
+    async def unwatch_document(self, event):
+        group = generate_document_counts_group_name(event["share_token"])
+        self.watched_groups.discard(group)
+        await self.channel_layer.group_discard(group, self.channel_name)
 
     @sync_to_async
     def create_notification(self, recipient_id, message, notification_type):
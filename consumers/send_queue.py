@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedSendMixin:
+    """
+    Outgoing queue for a websocket consumer, so channel-layer handlers never
+    wait on a slow client.
+
+    Handlers call queue_send() instead of send(); a drain task per connection
+    does the actual sends. The queue holds at most WS_SEND_QUEUE_SIZE frames.
+    Frames given a coalesce_key are superseded by a newer frame with the
+    same key while still queued (a member count, a user's presence). Nothing
+    is ever dropped without a replacement: when the queue is full, or a
+    single send takes longer than WS_SEND_TIMEOUT, the client is too slow to
+    keep up and gets disconnected (4008), to resync when it reconnects. A send that fails outright is logged and the socket closed with
+    1000, for the client to reconnect.
+    """
+
+    def _send_metric(self, name):
+        return metrics.counter(name, consumer=type(self).__name__)
+
+    async def queue_send(self, text_data=None, bytes_data=None, coalesce_key=None):
+        if getattr(self, "_send_closed", False):
+            return
+        if not hasattr(self, "_send_queue"):
+            self._send_queue = deque()
+            self._send_keys = {}
+            self._send_ready = asyncio.Event()
+            self._send_task = asyncio.create_task(self._drain_send_queue())
+
+        frame = {"text_data": text_data, "bytes_data": bytes_data}
+        queued = self._send_keys.get(coalesce_key) if coalesce_key is not None else None
+        if queued is not None:
+            queued[1] = frame
+            self._send_metric("ws_send_coalesced_total").inc()
+            return
+
+        if len(self._send_queue) >= settings.WS_SEND_QUEUE_SIZE:
+            await self._disconnect_slow_client()
+            return
+
+        item = [coalesce_key, frame]
+        self._send_queue.append(item)
+        if coalesce_key is not None:
+            self._send_keys[coalesce_key] = item
+        self._send_ready.set()
+
+    async def _drain_send_queue(self):
+        while True:
+            await self._send_ready.wait()
+            while self._send_queue:
+                key, frame = self._send_queue.popleft()
+                if key is not None:
+                    del self._send_keys[key]
+                try:
+                    await asyncio.wait_for(self.send(**frame), timeout=settings.WS_SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    await self._disconnect_slow_client()
+                    return
+                except Exception:
+                    logger.exception("Could not send a frame from %s, closing the socket", type(self).__name__)
+                    await self._stop_sending(code=1000)
+                    return
+            self._send_ready.clear()
+
+    async def _disconnect_slow_client(self):
+        self._send_metric("ws_send_disconnected_total").inc()
+        await self._stop_sending(code=4008)
+
+    async def _stop_sending(self, code):
+        self._send_closed = True
+        self._send_queue.clear()
+        self._send_keys.clear()
+        await self.close(code=code)
+
+    async def websocket_disconnect(self, message):
+        task = getattr(self, "_send_task", None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,588 @@
+import asyncio
+import json
+import uuid
+from unittest import mock
+
+import fakeredis
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from pycrdt import (
+    Doc, Text, YMessageType, YSyncMessageType, create_awareness_message, create_sync_message,
+    create_update_message, read_message, write_message,
+)
+
+from consumers import yjs_room
+from consumers.document_consumer import reap_presence
+from consumers.send_queue import BoundedSendMixin
+from consumers.yjs_awareness import NULL_STATE, decode_awareness_update, encode_awareness_update
+from consumers.yjs_relay import PROCESS_ID, SYNC_REQUEST, UPDATE, YjsRelay
+from document import ydoc_store
+from document.models import Document, DocumentAccess, YDocSnapshot, YDocUpdate
+from document.routing import websocket_urlpatterns
+from user_auth.models import CustomUser
+from utils import redis_client
+from utils.redis_key_generator import (
+    get_channel_for_yjs_room, get_key_for_document_live_users, get_key_for_presence_deadlines,
+    get_key_for_user_sockets,
+)
+
+
+class AsUser:
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope["user"] = self.user
+        return await self.app(scope, receive, send)
+
+
+class ConsumerTestCase(TestCase):
+    """Runs the websocket routes against fakeredis and the in-memory channel layer."""
+
+    @classmethod
+    def setUpClass(cls):
+        # saving a document publishes a cache invalidation, so Redis is needed from the start
+        cls.server = fakeredis.FakeServer()
+        cls.redis = fakeredis.FakeRedis(server=cls.server)
+        redis_client.use_clients(cls.redis, None)
+        cls.addClassCleanup(redis_client.use_clients, None, None)
+        super().setUpClass()
+
+    def setUp(self):
+        self.redis.flushall()
+        # every test runs in an event loop of its own, which an asyncio client can't outlive
+        redis_client.use_clients(self.redis, fakeredis.aioredis.FakeRedis(server=self.server))
+
+    async def open(self, user, path, **kwargs):
+        communicator = WebsocketCommunicator(AsUser(URLRouter(websocket_urlpatterns), user), path, **kwargs)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_until(self, communicator, matches, timeout=2):
+        """Read JSON events up to the first one that `matches`; returns all of them."""
+        received = []
+        while not received or not matches(received[-1]):
+            received.append(json.loads(await communicator.receive_from(timeout=timeout)))
+        return received
+
+
+@override_settings(PRESENCE_HEARTBEAT_INTERVAL=0.2, LIVE_MEMBER_COUNT_WINDOW=0)
+class PresenceSelfHealTests(ConsumerTestCase):
+    """A socket the reaper took for dead comes back for everyone on its next heartbeat."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email="admin@example.com", password="x", first_name="Admin")
+        cls.member = CustomUser.objects.create_user(email="member@example.com", password="x", first_name="Member")
+        cls.document = Document.objects.create(admin=cls.admin, name="live", is_live=True)
+        DocumentAccess.objects.create(document=cls.document, user=cls.member, can_edit=True, access_approved=True)
+
+    async def test_reaped_socket_rejoins(self):
+        path = f"/ws/documents/{self.document.share_token}/"
+        peer = await self.open(self.admin, path)
+        await self.receive_until(peer, lambda event: event["type"] == "live_users_list")
+        member = await self.open(self.member, path)
+        await self.receive_until(peer, lambda event: event["type"] == "live_members" and event["count"] == 2)
+
+        # the member's heartbeat is late: its deadlines pass and a reaper runs
+        redis = await redis_client.get_async_redis()
+        await redis.zadd(get_key_for_presence_deadlines(), {f"{self.document.share_token}:{self.member.id}": 0})
+        sockets = await redis.zrange(get_key_for_user_sockets(self.member.id), 0, -1)
+        await redis.zadd(get_key_for_user_sockets(self.member.id), dict.fromkeys(sockets, 0))
+        await reap_presence(get_channel_layer())
+
+        events = await self.receive_until(peer, lambda event: event["type"] == "user_left")
+        self.assertEqual(events[-1]["user"]["email"], "member@example.com")
+        events = await self.receive_until(peer, lambda event: event["type"] == "user_joined")
+        self.assertEqual(events[-1]["user"]["email"], "member@example.com")
+        await self.receive_until(peer, lambda event: event["type"] == "live_members" and event["count"] == 2)
+
+        entry = await redis.hget(get_key_for_document_live_users(self.document.share_token), str(self.member.id))
+        self.assertTrue(json.loads(entry)["is_online"])
+
+        await member.disconnect()
+        await peer.disconnect()
+
+
+class StalledSocket(BoundedSendMixin):
+    """A consumer whose client reads nothing until `reading` is set."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        self.reading = asyncio.Event()
+
+    async def send(self, text_data=None, bytes_data=None):
+        await self.reading.wait()
+        self.sent.append(text_data)
+
+    async def close(self, code=None):
+        self.closed = code
+
+
+@override_settings(WS_SEND_QUEUE_SIZE=3, WS_SEND_TIMEOUT=5)
+class SendQueueTests(TestCase):
+    """Queued frames are only ever replaced by a newer one with their key; overflow disconnects."""
+
+    async def test_coalesce(self):
+        socket = StalledSocket()
+        await socket.queue_send(text_data="first")
+        await asyncio.sleep(0)  # the drain task takes it and waits on the client
+        await socket.queue_send(text_data="count 1", coalesce_key="count")
+        await socket.queue_send(text_data="joined", coalesce_key="presence:1")
+        await socket.queue_send(text_data="count 2", coalesce_key="count")
+
+        socket.reading.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(socket.sent, ["first", "count 2", "joined"])
+        self.assertIsNone(socket.closed)
+
+    async def test_overflow_disconnects(self):
+        socket = StalledSocket()
+        await socket.queue_send(text_data="first")
+        await asyncio.sleep(0)
+        for i in range(3):
+            await socket.queue_send(text_data=f"user {i}", coalesce_key=f"presence:{i}")
+        self.assertIsNone(socket.closed)
+
+        # a fourth queued frame: nothing may be dropped for it, so the client goes
+        await socket.queue_send(text_data="users", coalesce_key="live_users_list")
+        self.assertEqual(socket.closed, 4008)
+
+        socket.reading.set()
+        await socket.queue_send(text_data="late")
+        await asyncio.sleep(0.05)
+        self.assertEqual(socket.sent, ["first"])
+
+
+def append_text(doc, text):
+    """Append to the "notes" text of a client Doc; returns the update that made the change."""
+    before = doc.get_state()
+    notes = doc.get("notes", type=Text)
+    notes += text
+    return doc.get_update(before)
+
+
+def stored_updates(share_token):
+    return [bytes(data) for data in YDocUpdate.objects.filter(document_id=share_token).values_list("data", flat=True)]
+
+
+@override_settings(YJS_ROOM_IDLE_TIMEOUT=0)
+class YjsTestCase(ConsumerTestCase):
+    """Yjs sockets of one live document; rooms are unloaded as soon as their last socket leaves."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email="admin@example.com", password="x", first_name="Admin")
+        cls.document = Document.objects.create(admin=cls.admin, name="live", is_live=True)
+        cls.path = f"/ws/yjs-server/{cls.document.share_token}"
+
+    def setUp(self):
+        super().setUp()
+        # a relay of its own, since its subscriber connection belongs to one event loop
+        patcher = mock.patch.object(yjs_room, "relay", YjsRelay())
+        self.relay = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(yjs_room._rooms.clear)
+        self.addCleanup(yjs_room._closing.clear)
+
+    async def open(self, user=None, path=None, **kwargs):
+        communicator = await super().open(user or self.admin, path or self.path, **kwargs)
+        # the server's sync step 1
+        await communicator.receive_from()
+        return communicator
+
+    async def receive_frame(self, communicator, kind, timeout=2):
+        """Read binary frames up to the first sync message of `kind`; returns its payload."""
+        while True:
+            frame = await communicator.receive_from(timeout=timeout)
+            if frame[:2] == bytes([YMessageType.SYNC, kind]):
+                return read_message(frame[2:])
+
+    async def read_notes(self, communicator):
+        """Sync an empty Doc through the socket and return its "notes" text."""
+        doc = Doc()
+        await communicator.send_to(bytes_data=create_sync_message(doc))
+        doc.apply_update(await self.receive_frame(communicator, YSyncMessageType.SYNC_STEP2))
+        return str(doc.get("notes", type=Text))
+
+    async def eventually(self, check, timeout=3):
+        """Wait until the sync callable `check` returns something truthy, and return that."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not (result := await sync_to_async(check)()):
+            self.assertLess(loop.time(), deadline, "timed out")
+            await asyncio.sleep(0.02)
+        return result
+
+
+class YjsPersistenceTests(YjsTestCase):
+    """Edits go to the update log, are folded into the snapshot, and come back when the room is reloaded."""
+
+    async def test_edit_is_logged(self):
+        client = await self.open()
+        update = append_text(Doc(), "hello")
+        await client.send_to(bytes_data=create_update_message(update))
+
+        self.assertEqual(await self.eventually(lambda: stored_updates(self.document.share_token)), [update])
+        await client.disconnect()
+
+    @override_settings(YJS_SNAPSHOT_EVERY=3)
+    async def test_log_is_folded_into_snapshot(self):
+        client = await self.open()
+        doc = Doc()
+        for text in ("a", "b", "c"):
+            await client.send_to(bytes_data=create_update_message(append_text(doc, text)))
+
+        snapshot = await self.eventually(lambda: YDocSnapshot.objects.filter(document=self.document).first())
+        self.assertEqual(await sync_to_async(stored_updates)(self.document.share_token), [])
+        stored = Doc()
+        stored.apply_update(bytes(snapshot.state))
+        self.assertEqual(str(stored.get("notes", type=Text)), "abc")
+        await client.disconnect()
+
+    async def test_cold_room_loads_snapshot_and_tail(self):
+        doc = Doc()
+        share_token = self.document.share_token
+        await sync_to_async(ydoc_store.append_updates)(share_token, [append_text(doc, "hello")])
+        await sync_to_async(ydoc_store.fold_updates)(share_token)
+        await sync_to_async(ydoc_store.append_updates)(share_token, [append_text(doc, " world")])
+
+        self.assertNotIn(str(share_token), yjs_room._rooms)
+        client = await self.open()
+        self.assertEqual(await self.read_notes(client), "hello world")
+        await client.disconnect()
+
+    async def test_edits_survive_room_unload(self):
+        client = await self.open()
+        await client.send_to(bytes_data=create_update_message(append_text(Doc(), "kept")))
+        await self.eventually(lambda: stored_updates(self.document.share_token))
+        # the last socket out unloads the room, which snapshots it
+        await client.disconnect()
+        self.assertNotIn(str(self.document.share_token), yjs_room._rooms)
+
+        client = await self.open()
+        self.assertEqual(await self.read_notes(client), "kept")
+        await client.disconnect()
+
+    async def test_failed_write_is_retried(self):
+        append_updates = ydoc_store.append_updates
+        calls = []
+
+        def fail_once(share_token, updates):
+            calls.append(updates)
+            if len(calls) == 1:
+                raise DatabaseError("database is down")
+            append_updates(share_token, updates)
+
+        client = await self.open()
+        update = append_text(Doc(), "retried")
+        with mock.patch.object(ydoc_store, "append_updates", fail_once), \
+                self.assertLogs("consumers.yjs_room", "ERROR") as logs:
+            await client.send_to(bytes_data=create_update_message(update))
+            stored = await self.eventually(lambda: stored_updates(self.document.share_token))
+
+        self.assertEqual(stored, [update])
+        self.assertEqual(calls, [[update], [update]])
+        self.assertIn("Could not persist 1 updates", logs.output[0])
+        await client.disconnect()
+
+
+class YjsRelayTests(YjsTestCase):
+    """Rooms of the same document in other workers are kept in sync over Redis pub/sub."""
+
+    # the sender id of a worker process other than this one
+    peer = uuid.uuid4().bytes
+
+    def setUp(self):
+        super().setUp()
+        self.channel = get_channel_for_yjs_room(self.document.share_token)
+
+    async def subscribe(self):
+        pubsub = (await redis_client.get_async_redis()).pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        return pubsub
+
+    async def relayed(self, pubsub, kind, timeout=2):
+        """Payload of the next message of `kind` this process published to the room."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            message = await pubsub.get_message(timeout=0.1)
+            if message is not None and message["data"][:17] == kind + PROCESS_ID:
+                return message["data"][17:]
+        self.fail("nothing relayed")
+
+    async def test_local_edit_is_published(self):
+        pubsub = await self.subscribe()
+        client = await self.open()
+        await client.send_to(bytes_data=create_update_message(append_text(Doc(), "hello")))
+
+        doc = Doc()
+        doc.apply_update(await self.relayed(pubsub, UPDATE))
+        self.assertEqual(str(doc.get("notes", type=Text)), "hello")
+        await client.disconnect()
+        await pubsub.aclose()
+
+    async def test_remote_edit_reaches_sockets(self):
+        client = await self.open()
+        redis = await redis_client.get_async_redis()
+        await redis.publish(self.channel, UPDATE + self.peer + append_text(Doc(), "from a peer"))
+
+        doc = Doc()
+        doc.apply_update(await self.receive_frame(client, YSyncMessageType.SYNC_UPDATE))
+        self.assertEqual(str(doc.get("notes", type=Text)), "from a peer")
+        self.assertEqual(await self.read_notes(client), "from a peer")
+        # the worker that took the edit in persists it
+        await asyncio.sleep(0.1)
+        self.assertEqual(await sync_to_async(stored_updates)(self.document.share_token), [])
+        await client.disconnect()
+
+    async def test_sync_request_is_answered(self):
+        client = await self.open()
+        await client.send_to(bytes_data=create_update_message(append_text(Doc(), "hello")))
+        await self.eventually(lambda: stored_updates(self.document.share_token))
+
+        # a peer room that just loaded asks for whatever it is missing
+        pubsub = await self.subscribe()
+        redis = await redis_client.get_async_redis()
+        await redis.publish(self.channel, SYNC_REQUEST + self.peer + Doc().get_state())
+
+        doc = Doc()
+        doc.apply_update(await self.relayed(pubsub, UPDATE))
+        self.assertEqual(str(doc.get("notes", type=Text)), "hello")
+        await client.disconnect()
+        await pubsub.aclose()
+
+    async def test_own_messages_are_skipped(self):
+        client = await self.open()
+        redis = await redis_client.get_async_redis()
+        await redis.publish(self.channel, UPDATE + PROCESS_ID + append_text(Doc(), "echo"))
+
+        self.assertTrue(await client.receive_nothing(timeout=0.2))
+        self.assertEqual(await self.read_notes(client), "")
+        await client.disconnect()
+
+
+class YjsFanOutTests(YjsTestCase):
+    """Updates go out one frame each, or merged per YJS_COALESCE_WINDOW_MS window."""
+
+    async def send_edits(self, client, doc, texts):
+        for text in texts:
+            await client.send_to(bytes_data=create_update_message(append_text(doc, text)))
+
+    async def received_updates(self, communicator):
+        updates = []
+        while not await communicator.receive_nothing(timeout=0.2):
+            updates.append(await self.receive_frame(communicator, YSyncMessageType.SYNC_UPDATE))
+        return updates
+
+    async def test_frame_per_update(self):
+        writer, reader = await self.open(), await self.open()
+        await self.send_edits(writer, Doc(), "abc")
+
+        self.assertEqual(len(await self.received_updates(reader)), 3)
+        self.assertEqual(await self.received_updates(writer), [])
+        await writer.disconnect()
+        await reader.disconnect()
+
+    @override_settings(YJS_COALESCE_WINDOW_MS=100)
+    async def test_coalesced_frame(self):
+        writer, reader = await self.open(), await self.open()
+        await self.send_edits(writer, Doc(), "abc")
+
+        updates = await self.received_updates(reader)
+        self.assertEqual(len(updates), 1)
+        doc = Doc()
+        doc.apply_update(updates[0])
+        self.assertEqual(str(doc.get("notes", type=Text)), "abc")
+        # the only origin in the batch doesn't get its own edits back
+        self.assertEqual(await self.received_updates(writer), [])
+        await writer.disconnect()
+        await reader.disconnect()
+
+    @override_settings(YJS_COALESCE_WINDOW_MS=100)
+    async def test_coalesced_frame_of_several_writers(self):
+        first, second = await self.open(), await self.open()
+        await self.send_edits(first, Doc(), "a")
+        await self.send_edits(second, Doc(), "b")
+
+        # both get the one merged frame, their own edit included
+        for client in (first, second):
+            updates = await self.received_updates(client)
+            self.assertEqual(len(updates), 1)
+            doc = Doc()
+            doc.apply_update(updates[0])
+            self.assertEqual(sorted(str(doc.get("notes", type=Text))), ["a", "b"])
+        await first.disconnect()
+        await second.disconnect()
+
+
+def awareness_message(client_id, clock, state):
+    return create_awareness_message(encode_awareness_update([(client_id, clock, state)]))
+
+
+@override_settings(YJS_AWARENESS_FLUSH_INTERVAL=0.05, YJS_AWARENESS_RENEW_INTERVAL=0.3)
+class YjsAwarenessTests(YjsTestCase):
+    """Awareness states are only passed on when they changed or are due for renewal, and cleared with their owner."""
+
+    async def received_states(self, communicator):
+        """Awareness entries received until the socket goes quiet."""
+        entries = []
+        while not await communicator.receive_nothing(timeout=0.2):
+            frame = await communicator.receive_from()
+            if frame[0] == YMessageType.AWARENESS:
+                entries += decode_awareness_update(read_message(frame[1:]))
+        return entries
+
+    async def announce(self, owner, peer, clock, state):
+        """Send a state of Yjs client 1 from `owner`; returns what `peer` got of it."""
+        await owner.send_to(bytes_data=awareness_message(1, clock, state))
+        return await self.received_states(peer)
+
+    def resident_states(self):
+        return yjs_room._rooms[str(self.document.share_token)].awareness.states
+
+    async def test_unchanged_state_is_dropped(self):
+        owner, peer = await self.open(), await self.open()
+        self.assertEqual(await self.announce(owner, peer, 1, '{"cursor":1}'), [(1, 1, '{"cursor":1}')])
+        # a newer clock with the same state: nothing to tell anyone yet
+        self.assertEqual(await self.announce(owner, peer, 2, '{"cursor":1}'), [])
+        # an older clock is stale
+        self.assertEqual(await self.announce(owner, peer, 1, '{"cursor":3}'), [])
+        self.assertEqual(await self.announce(owner, peer, 3, '{"cursor":2}'), [(1, 3, '{"cursor":2}')])
+        await owner.disconnect()
+        await peer.disconnect()
+
+    async def test_unchanged_state_is_renewed(self):
+        owner, peer = await self.open(), await self.open()
+        self.assertEqual(await self.announce(owner, peer, 1, '{"cursor":1}'), [(1, 1, '{"cursor":1}')])
+        await asyncio.sleep(0.3)
+        # past YJS_AWARENESS_RENEW_INTERVAL, so the peer doesn't time the cursor out
+        self.assertEqual(await self.announce(owner, peer, 2, '{"cursor":1}'), [(1, 2, '{"cursor":1}')])
+        await owner.disconnect()
+        await peer.disconnect()
+
+    async def test_null_state_removes_client(self):
+        owner, peer = await self.open(), await self.open()
+        await self.announce(owner, peer, 1, '{"cursor":1}')
+        self.assertIn(1, self.resident_states())
+        self.assertEqual(await self.announce(owner, peer, 2, NULL_STATE), [(1, 2, NULL_STATE)])
+        self.assertNotIn(1, self.resident_states())
+        await owner.disconnect()
+        await peer.disconnect()
+
+    async def test_disconnect_clears_states(self):
+        owner, peer = await self.open(), await self.open()
+        await self.announce(owner, peer, 1, '{"cursor":1}')
+        await owner.disconnect()
+        self.assertEqual(await self.received_states(peer), [(1, 2, NULL_STATE)])
+        self.assertNotIn(1, self.resident_states())
+        await peer.disconnect()
+
+
+@override_settings(YJS_ROOM_IDLE_TIMEOUT=300, YJS_ROOM_MEMORY_BUDGET_MB=1)
+class YjsEvictionTests(YjsTestCase):
+    """Rooms nobody is in are unloaded after YJS_ROOM_IDLE_TIMEOUT, or earlier, LRU first, over the memory budget."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = Document.objects.create(admin=cls.admin, name="other", is_live=True)
+
+    def resident(self, document):
+        return str(document.share_token) in yjs_room._rooms
+
+    async def write(self, document, size):
+        """Open a socket on `document` and write `size` characters through it."""
+        client = await self.open(path=f"/ws/yjs-server/{document.share_token}")
+        await client.send_to(bytes_data=create_update_message(append_text(Doc(), "x" * size)))
+        await self.eventually(lambda: stored_updates(document.share_token))
+        return client
+
+    @override_settings(YJS_ROOM_IDLE_TIMEOUT=0.1)
+    async def test_idle_room_is_evicted(self):
+        client = await self.write(self.document, 4)
+        await client.disconnect()
+        await yjs_room.evict_rooms()
+        self.assertTrue(self.resident(self.document))
+
+        await asyncio.sleep(0.1)
+        await yjs_room.evict_rooms()
+        self.assertFalse(self.resident(self.document))
+        # unloading flushed and snapshotted the room
+        snapshot = await sync_to_async(YDocSnapshot.objects.get)(document=self.document)
+        stored = Doc()
+        stored.apply_update(bytes(snapshot.state))
+        self.assertEqual(str(stored.get("notes", type=Text)), "xxxx")
+
+    async def test_least_recently_used_room_is_evicted_over_budget(self):
+        for document in (self.document, self.other):
+            client = await self.write(document, 600 * 1024)
+            await client.disconnect()
+
+        await yjs_room.evict_rooms()
+        self.assertFalse(self.resident(self.document))
+        self.assertTrue(self.resident(self.other))
+
+    async def test_occupied_room_is_kept_over_budget(self):
+        idle = await self.write(self.other, 4)
+        await idle.disconnect()
+        client = await self.write(self.document, 1200 * 1024)
+
+        await yjs_room.evict_rooms()
+        self.assertFalse(self.resident(self.other))
+        self.assertTrue(self.resident(self.document))
+        await client.disconnect()
+
+
+@override_settings(YJS_VIEWER_FLUSH_INTERVAL=0.5)
+class YjsViewerTests(YjsTestCase):
+    """Sockets without edit rights can only read, and get the room's updates in batches."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.viewer = CustomUser.objects.create_user(email="viewer@example.com", password="x", first_name="Viewer")
+        DocumentAccess.objects.create(document=cls.document, user=cls.viewer, can_edit=False, access_approved=True)
+
+    async def test_viewer_edits_are_dropped(self):
+        editor, viewer = await self.open(), await self.open(self.viewer)
+        update = append_text(Doc(), "not allowed")
+        sync_step2 = bytes([YMessageType.SYNC, YSyncMessageType.SYNC_STEP2]) + write_message(update)
+        for frame in (create_update_message(update), sync_step2, awareness_message(1, 1, '{"cursor":1}')):
+            await viewer.send_to(bytes_data=frame)
+
+        self.assertTrue(await editor.receive_nothing(timeout=0.2))
+        self.assertEqual(await self.read_notes(editor), "")
+        self.assertEqual(await sync_to_async(stored_updates)(self.document.share_token), [])
+        # reading is still allowed
+        self.assertEqual(await self.read_notes(viewer), "")
+        await editor.disconnect()
+        await viewer.disconnect()
+
+    async def test_viewers_get_batched_updates(self):
+        editor, viewer = await self.open(), await self.open(self.viewer)
+        doc = Doc()
+        for text in "abc":
+            await editor.send_to(bytes_data=create_update_message(append_text(doc, text)))
+            await asyncio.sleep(0.05)
+
+        # nothing before YJS_VIEWER_FLUSH_INTERVAL, then one frame with all of it
+        self.assertTrue(await viewer.receive_nothing(timeout=0.2))
+        received = Doc()
+        received.apply_update(await self.receive_frame(viewer, YSyncMessageType.SYNC_UPDATE, timeout=1))
+        self.assertEqual(str(received.get("notes", type=Text)), "abc")
+        self.assertTrue(await viewer.receive_nothing(timeout=0.2))
+
+        await editor.send_to(bytes_data=create_update_message(append_text(doc, "d")))
+        received.apply_update(await self.receive_frame(viewer, YSyncMessageType.SYNC_UPDATE, timeout=1))
+        self.assertEqual(str(received.get("notes", type=Text)), "abcd")
+        await editor.disconnect()
+        await viewer.disconnect()
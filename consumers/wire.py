@@ -0,0 +1,45 @@
+"""
+Wire formats of the JSON-event websockets (ws/documents/, ws/notifications/).
+
+Clients that offer the MSGPACK_SUBPROTOCOL subprotocol get every event as one
+msgpack-encoded binary frame and may send theirs the same way; everyone else
+keeps getting JSON text frames.
+"""
+import json
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "livedoc.msgpack"
+
+
+def encode_json(payload):
+    return {"text_data": json.dumps(payload)}
+
+
+def encode_msgpack(payload):
+    return {"bytes_data": msgpack.packb(payload)}
+
+
+def decode_frame(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        return msgpack.unpackb(bytes_data)
+    return json.loads(text_data)
+
+
+class WireProtocolMixin:
+    """Negotiates the wire format on accept() and encodes events accordingly."""
+
+    use_msgpack = False
+
+    async def accept(self, subprotocol=None, headers=None):
+        if subprotocol is None and MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", []):
+            subprotocol = MSGPACK_SUBPROTOCOL
+        self.use_msgpack = subprotocol == MSGPACK_SUBPROTOCOL
+        await super().accept(subprotocol=subprotocol, headers=headers)
+
+    def encode_event(self, payload):
+        """send()/queue_send() keyword arguments carrying the payload in this socket's format."""
+        return encode_msgpack(payload) if self.use_msgpack else encode_json(payload)
+
+    def decode_event(self, text_data=None, bytes_data=None):
+        return decode_frame(text_data, bytes_data)
@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+from django.conf import settings
+from pycrdt import Decoder, Encoder, create_awareness_message, read_message
+
+from utils import metrics
+
+NULL_STATE = "null"
+
+
+def decode_awareness_update(payload):
+    """Yield (client_id, clock, state) entries of an awareness update; state is the raw JSON string."""
+    decoder = Decoder(payload)
+    for _ in range(decoder.read_var_uint()):
+        client_id = decoder.read_var_uint()
+        clock = decoder.read_var_uint()
+        yield client_id, clock, decoder.read_var_string() or NULL_STATE
+
+
+def encode_awareness_update(entries):
+    encoder = Encoder()
+    encoder.write_var_uint(len(entries))
+    for client_id, clock, state in entries:
+        encoder.write_var_uint(client_id)
+        encoder.write_var_uint(clock)
+        encoder.write_var_string(state)
+    return encoder.to_bytes()
+
+
+class RoomAwareness:
+    """
+    Server-side awareness (cursors, selections, user info) of a room.
+
+    Only the latest state per Yjs client is kept. Incoming updates just mark
+    clients dirty; at most once per YJS_AWARENESS_FLUSH_INTERVAL the dirty
+    states are sent to the room's sockets as one message. A state that did not
+    change is not sent again, except as a periodic renewal so that clients do
+    not time the cursor out. States owned by a socket that goes away are
+    cleared for everyone, and remote states nobody renews are forgotten.
+    """
+
+    def __init__(self, room):
+        self.room = room
+        # client_id -> (clock, state, monotonic time of the last update)
+        self.states = {}
+        # client_id -> consumer that announced it, for local clients only
+        self.owners = {}
+        self._last_sent = {}
+        self._dirty = {}
+        self._task = None
+
+    def apply(self, message, origin=None, remote=False):
+        """Take in an awareness message from a local socket, or from another worker when `remote`."""
+        for client_id, clock, state in decode_awareness_update(read_message(message[1:])):
+            metrics.counter("yjs_awareness_in_total").inc()
+            current = self.states.get(client_id)
+            if current is not None and (clock < current[0] or (clock == current[0] and state != NULL_STATE)):
+                continue
+
+            now = time.monotonic()
+            self.states[client_id] = (clock, state, now)
+            if not remote and origin is not None:
+                self.owners[client_id] = origin
+
+            renewal_due = now - self._last_sent.get(client_id, 0) >= settings.YJS_AWARENESS_RENEW_INTERVAL
+            if current is not None and current[1] == state and not renewal_due:
+                metrics.counter("yjs_awareness_dropped_total").inc()
+                continue
+            self._dirty[client_id] = remote
+
+        self._schedule_flush()
+
+    def remove_client(self, consumer):
+        """Clear the states of a socket that disconnected."""
+        for client_id, owner in list(self.owners.items()):
+            if owner is not consumer:
+                continue
+            del self.owners[client_id]
+            clock = self.states[client_id][0] if client_id in self.states else 0
+            self.states[client_id] = (clock + 1, NULL_STATE, time.monotonic())
+            self._dirty[client_id] = False
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._dirty and self._task is None:
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.YJS_AWARENESS_FLUSH_INTERVAL)
+        self._task = None
+        await self.flush()
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+
+        now = time.monotonic()
+        entries, local_entries = [], []
+        for client_id, remote in dirty.items():
+            clock, state, _ = self.states[client_id]
+            entries.append((client_id, clock, state))
+            if not remote:
+                local_entries.append((client_id, clock, state))
+            self._last_sent[client_id] = now
+            if state == NULL_STATE:
+                self.states.pop(client_id, None)
+                self._last_sent.pop(client_id, None)
+        self._forget_stale(now)
+
+        message = create_awareness_message(encode_awareness_update(entries))
+        await self.room.broadcast(message)
+        self.room.queue_for_viewers(awareness=message)
+        metrics.counter("yjs_awareness_out_total").inc()
+        if local_entries:
+            # other workers only need what originated here
+            self.room.publish_awareness(create_awareness_message(encode_awareness_update(local_entries)))
+
+    def _forget_stale(self, now):
+        # clients time these out on their own; this only keeps the server-side map from growing
+        # when the worker that owned them died without clearing them
+        for client_id, (_, _, updated_at) in list(self.states.items()):
+            if now - updated_at > settings.YJS_AWARENESS_TIMEOUT and client_id not in self.owners:
+                del self.states[client_id]
+                self._last_sent.pop(client_id, None)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
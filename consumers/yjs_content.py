@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from pycrdt import Text, XmlFragment, XmlText
+
+from document.models import Document
+
+logger = logging.getLogger(__name__)
+
+
+def get_content_root(ydoc):
+    """
+    The shared type the editor keeps the document body in (see YJS_CONTENT_ROOT).
+    Raises TypeError when the Doc already holds that root as another type.
+    """
+    expected = Text if settings.YJS_CONTENT_TYPE == "text" else XmlFragment
+    # a root that only arrived in updates has no type yet and is absent here;
+    # one with a type would be cast without complaint, and misread later
+    existing = dict(ydoc.items()).get(settings.YJS_CONTENT_ROOT)
+    if existing is not None and type(existing) is not expected:
+        raise TypeError(
+            f"Yjs root {settings.YJS_CONTENT_ROOT!r} is a {type(existing).__name__}, not a {expected.__name__}"
+        )
+    return ydoc.get(settings.YJS_CONTENT_ROOT, type=expected)
+
+
+def _is_panic(error):
+    # pycrdt raises pyo3's PanicException, a BaseException, e.g. when a root
+    # holding text is read as XML; its class can't be imported
+    return type(error).__name__ == "PanicException"
+
+
+def _xml_to_text(node):
+    if isinstance(node, XmlText):
+        return "".join(chunk for chunk, _ in node.diff() if isinstance(chunk, str))
+
+    children = list(node.children)
+    separator = "" if all(isinstance(child, XmlText) for child in children) else "\n"
+    return separator.join(_xml_to_text(child) for child in children)
+
+
+def read_document_text(ydoc):
+    """Plain text of the document body, one line per block for rich-text editors."""
+    root = get_content_root(ydoc)
+    if isinstance(root, Text):
+        return str(root)
+    return _xml_to_text(root)
+
+
+@sync_to_async
+def save_document_text(share_token, text):
+    Document.objects.filter(share_token=share_token).update(content=text, updated_at=timezone.now())
+
+
+class ContentWriter:
+    """
+    Write-behind of a room's text into Document.content.
+
+    Edits only mark the room dirty; the text is extracted and written with a
+    single UPDATE at most once per YJS_CONTENT_FLUSH_INTERVAL seconds, and one
+    last time when the room closes. Edits relayed from other workers are left
+    to the worker that received them.
+    """
+
+    def __init__(self, room):
+        self.room = room
+        self._dirty = False
+        self._task = None
+        self._subscription = None
+        self._root = None
+
+    def start(self):
+        try:
+            self._root = get_content_root(self.room.ydoc)
+        except TypeError:
+            # the room still works, only Document.content stops following it
+            logger.exception("Content write-behind disabled for Yjs room %s", self.room.name)
+            return
+        self._subscription = self._root.observe_deep(self._on_change)
+
+    async def close(self):
+        if self._subscription is not None:
+            self._root.unobserve(self._subscription)
+            self._subscription = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def _on_change(self, events):
+        if self.room.applying_remote:
+            # the worker the edit came from writes it
+            return
+        self._dirty = True
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.YJS_CONTENT_FLUSH_INTERVAL)
+        self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        try:
+            text = read_document_text(self.room.ydoc)
+            await save_document_text(self.room.name, text)
+        except Exception:
+            logger.exception("Could not write content of Yjs room %s", self.room.name)
+            self._dirty = True
+        except BaseException as e:
+            if not _is_panic(e):
+                raise
+            logger.exception("Could not read content of Yjs room %s", self.room.name)
@@ -1,10 +1,20 @@
 from asgiref.sync import sync_to_async
 from pycrdt.websocket.django_channels_consumer import YjsConsumer
-from pycrdt import Doc, Text, XmlFragment
+from pycrdt import Doc, YMessageType, YSyncMessageType, create_sync_message, handle_sync_message, read_message
 
-from document.models import Document
+from consumers.yjs_room import join_room, leave_room
+from document.models import DocumentAccess
+from utils import metrics
+from utils.document_cache import get_document_info
+
+SYNC_STEP1 = bytes([YMessageType.SYNC, YSyncMessageType.SYNC_STEP1])
 
 class YjsDocumentConsumer(YjsConsumer):
+    def __init__(self):
+        super().__init__()
+        self.room = None
+        self.can_edit = False
+
     async def connect(self):
         # Check the user in self.scope["user"]
         if "user" in self.scope and self.scope["user"] is None:
@@ -15,24 +25,73 @@ class YjsDocumentConsumer(YjsConsumer):
         document = await self.get_document()
 
 
-        if not document.is_live and document.admin != self.scope["user"]:
+        if not document.is_live and document.admin_id != getattr(self.scope["user"], "id", None):
             await self.close()
             return
 
+        # without edit rights the socket joins as a viewer: batched updates, nothing accepted from it
+        self.can_edit = await self.get_can_edit(document)
+
+        # no channel-layer group here: the room fans updates out to the local
+        # sockets and relays them to other workers itself
+        self.room_name = self.make_room_name()
+        await self.accept()
 
-        await super().connect()
+        # sockets joining a cold room all wait on its one load; the client's
+        # sync step 1 is then answered with a diff against the room's Doc
+        self.ydoc = await self.make_ydoc()
+        await self.send(bytes_data=create_sync_message(self.ydoc))
 
     async def make_ydoc(self) -> Doc:
-        doc = Doc()
-        return doc
+        # all sockets of a document share one Doc, rehydrated from the snapshot + update log
+        self.room = await join_room(self.room_name, self, viewer=not self.can_edit)
+        return self.room.ydoc
+
+    async def disconnect(self, code):
+        if self.room is not None:
+            await leave_room(self.room, self)
+            self.room = None
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if not bytes_data:
+            return
+
+        if not self.can_edit and bytes_data[:2] != SYNC_STEP1:
+            # viewers only get to ask for the document
+            metrics.counter("yjs_viewer_dropped_total").inc()
+            return
+
+        if self.room is None:
+            return
+
+        if bytes_data[0] == YMessageType.AWARENESS:
+            self.room.apply_awareness(bytes_data, origin=self)
+            return
+
+        if bytes_data[0] != YMessageType.SYNC:
+            return
+
+        if bytes_data[1] == YSyncMessageType.SYNC_STEP1:
+            reply = handle_sync_message(bytes_data[1:], self.ydoc)
+            await self.send(bytes_data=reply)
+        elif bytes_data[1] in (YSyncMessageType.SYNC_STEP2, YSyncMessageType.SYNC_UPDATE):
+            self.room.apply_update(read_message(bytes_data[2:]), origin=self)
 
 
     @sync_to_async
-    def get_document(self):
-        room = self.scope["url_route"]["kwargs"]["room"]
-        # Assuming you have a method to get the document by room name
-        return Document.objects.select_related("admin").get(share_token=room)
+    def get_can_edit(self, document):
+        # same rule as DocumentSerializer.get_can_write_access
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            return False
+        if document.admin_id == user.id:
+            return True
+        return DocumentAccess.objects.filter(
+            document_id=document.id, user=user, can_edit=True, access_approved=True
+        ).exists()
 
     @sync_to_async
-    def save_document_text(token, text):
-        Document.objects.filter(share_token=token).update(content=text)
\ No newline at end of file
+    def get_document(self):
+        room = self.scope["url_route"]["kwargs"]["room"]
+        # id / admin_id / is_live, cached per process
+        return get_document_info(room)
\ No newline at end of file
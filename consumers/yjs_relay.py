@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import uuid
+
+from pycrdt import merge_updates
+
+from utils.redis_client import get_async_redis
+from utils.redis_key_generator import get_channel_for_yjs_room
+
+logger = logging.getLogger(__name__)
+
+# message kinds on a room channel
+UPDATE = b"u"
+AWARENESS = b"a"
+SYNC_REQUEST = b"s"
+
+# identifies this process, so it can skip its own messages
+PROCESS_ID = uuid.uuid4().bytes
+
+
+class YjsRelay:
+    """
+    Relays Yjs rooms between worker processes over Redis pub/sub.
+
+    Each process keeps a single subscriber connection for all of its resident
+    rooms. Local updates are buffered and published once per room per event
+    loop tick, merged into a single update, so a burst of keystrokes costs one
+    PUBLISH per room. Messages from other processes are handed to the room,
+    which applies them to its Doc and fans them out to its own sockets.
+
+    Whatever was published while the subscriber connection was down is lost,
+    so once it is back every room asks its peers again for what it is missing
+    (a SYNC_REQUEST with its state vector, as on start).
+    """
+
+    def __init__(self):
+        self.rooms = {}
+        self._redis = None
+        self._pubsub = None
+        self._listener = None
+        # set while there are rooms to listen for
+        self._subscribed = asyncio.Event()
+        self._updates = {}
+        self._messages = []
+        self._flush_scheduled = False
+
+    async def _ensure_started(self):
+        if self._pubsub is not None:
+            return
+        redis = await get_async_redis()
+        if self._pubsub is None:
+            self._redis = redis
+            self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            self._listener = asyncio.create_task(self._listen())
+
+    async def subscribe(self, room):
+        self.rooms[room.name] = room
+        try:
+            await self._ensure_started()
+            await self._pubsub.subscribe(get_channel_for_yjs_room(room.name))
+            self._subscribed.set()
+        except Exception:
+            # the room still works for the sockets of this worker
+            logger.exception("Could not subscribe to Yjs room %s", room.name)
+
+    async def unsubscribe(self, room):
+        if self.rooms.get(room.name) is not room:
+            return
+        del self.rooms[room.name]
+        try:
+            await self._pubsub.unsubscribe(get_channel_for_yjs_room(room.name))
+        except Exception:
+            logger.exception("Could not unsubscribe from Yjs room %s", room.name)
+
+    def publish_update(self, room_name, update):
+        self._updates.setdefault(room_name, []).append(update)
+        self._schedule_flush()
+
+    def publish(self, room_name, kind, payload):
+        self._messages.append((room_name, kind, payload))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            # runs on the next loop iteration, after everything queued in this one
+            asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        self._flush_scheduled = False
+        updates, self._updates = self._updates, {}
+        messages, self._messages = self._messages, []
+        if self._redis is None:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        for room_name, pending in updates.items():
+            update = pending[0] if len(pending) == 1 else merge_updates(*pending)
+            pipe.publish(get_channel_for_yjs_room(room_name), UPDATE + PROCESS_ID + update)
+        for room_name, kind, payload in messages:
+            pipe.publish(get_channel_for_yjs_room(room_name), kind + PROCESS_ID + payload)
+
+        try:
+            await pipe.execute()
+        except Exception:
+            logger.exception("Could not relay Yjs updates for %d rooms", len(updates))
+
+    async def _listen(self):
+        resync = False
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    self._subscribed.clear()
+                    await self._subscribed.wait()
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Yjs relay connection failed, retrying")
+                resync = True
+                await asyncio.sleep(1)
+                continue
+
+            if resync:
+                # reconnected and subscribed again
+                resync = False
+                self._request_sync()
+
+            if message is None or message["type"] != "message":
+                continue
+            self._dispatch(message["channel"], message["data"])
+
+    def _request_sync(self):
+        for room in list(self.rooms.values()):
+            self.publish(room.name, SYNC_REQUEST, room.ydoc.get_state())
+
+    def _dispatch(self, channel, data):
+        kind, sender, payload = data[:1], data[1:17], data[17:]
+        if sender == PROCESS_ID:
+            return
+
+        room_name = channel.decode().split(":", 1)[1]
+        room = self.rooms.get(room_name)
+        if room is None:
+            return
+
+        try:
+            room.receive_remote(kind, payload)
+        except Exception:
+            logger.exception("Could not apply relayed message to Yjs room %s", room_name)
+
+
+relay = YjsRelay()
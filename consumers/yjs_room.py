@@ -0,0 +1,407 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from pycrdt import Doc, create_update_message, merge_updates
+
+from consumers.yjs_awareness import RoomAwareness
+from consumers.yjs_content import ContentWriter
+from consumers.yjs_relay import relay, UPDATE, AWARENESS, SYNC_REQUEST
+from document.ydoc_store import DjangoYStore, EMPTY_UPDATE
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# rooms that are resident in this process, keyed by share token
+_rooms = {}
+# rooms that are still flushing to the store after their last client left
+_closing = {}
+
+# origin of updates relayed from other worker processes
+REMOTE = "remote"
+
+
+class YjsRoom:
+    """
+    The shared Doc of one document inside this process, plus its persistence.
+
+    Every consumer connected to the same share token works on the same Doc.
+    Updates applied to it are queued and appended to the store by a single
+    writer task, which also folds the log into a snapshot every
+    YJS_SNAPSHOT_EVERY updates, compacting it once YJS_COMPACT_AFTER_BYTES
+    were written since the last compaction. The document text is written
+    back to Document.content by a ContentWriter.
+
+    Rooms of the same document in other workers are kept in sync through the
+    Redis relay: local updates are published there, and updates coming from
+    it are applied to the Doc and fanned out to the local sockets, but not
+    persisted again.
+
+    With YJS_COALESCE_WINDOW_MS set, updates are held for that long and the
+    pending ones are merged into a single frame for all sockets, instead of
+    one frame per update per socket.
+
+    A room stays resident for YJS_ROOM_IDLE_TIMEOUT seconds after its last
+    client leaves, so a reconnect does not reload it; idle rooms are evicted
+    earlier, least recently used first, when the resident rooms of the process
+    grow past YJS_ROOM_MEMORY_BUDGET_MB.
+
+    Sockets without edit rights join as viewers. They never feed the Doc, and
+    instead of the per-update fan-out they get the room's updates and
+    awareness batched every YJS_VIEWER_FLUSH_INTERVAL, from a separate task,
+    so a large audience does not slow down the editors.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.ydoc = Doc()
+        self.store = DjangoYStore(name)
+        self.clients = set()
+        self.viewers = set()
+        self.loading = None
+        self.content = ContentWriter(self)
+        self.awareness = RoomAwareness(self)
+        # approximate size of the Doc: the stored state plus every update applied since
+        self.size = 0
+        self.last_active = asyncio.get_running_loop().time()
+        self.idle_since = None
+
+        self._pending = []
+        self._has_pending = asyncio.Event()
+        self._writer = None
+        self._subscription = None
+        self._origin = None
+        self._outbox = []
+        self._outbox_since = 0.0
+        self._fan_out_scheduled = False
+        self._viewer_updates = []
+        self._viewer_awareness = []
+        self._viewer_fan_out_scheduled = False
+        # bytes persisted since the stored history was last compacted
+        self._written = 0
+
+    async def start(self):
+        """Load the Doc from the store."""
+        previous = _closing.get(self.name)
+        if previous is not None:
+            # don't read the store before the previous instance finished writing it
+            await asyncio.shield(previous)
+
+        # subscribe first so nothing published while loading is missed
+        await relay.subscribe(self)
+        state = await self.store.read_state()
+        if state is not None:
+            self.ydoc.apply_update(state)
+            self.size = len(state)
+
+        self._subscription = self.ydoc.observe(self._on_update)
+        self._writer = asyncio.create_task(self._write_loop())
+        self.content.start()
+
+        # peers answer with whatever they hold that is not persisted yet
+        relay.publish(self.name, SYNC_REQUEST, self.ydoc.get_state())
+
+    async def stop(self):
+        await self.awareness.flush()
+        await self.awareness.close()
+        await relay.unsubscribe(self)
+
+        if self._subscription is not None:
+            self.ydoc.unobserve(self._subscription)
+            self._subscription = None
+
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+        # the edits go to the store first, so a failing content write can't cost them
+        await self._flush()
+        await self._snapshot()
+        await self.content.close()
+
+    def apply_update(self, update, origin=None):
+        """Apply an update to the Doc; origin is the consumer that sent it, or REMOTE."""
+        self._origin = origin
+        try:
+            self.ydoc.apply_update(update)
+        finally:
+            self._origin = None
+
+    @property
+    def occupied(self):
+        return bool(self.clients or self.viewers)
+
+    @property
+    def applying_remote(self):
+        return self._origin is REMOTE
+
+    def apply_awareness(self, message, origin=None):
+        self.awareness.apply(message, origin)
+
+    def publish_awareness(self, message):
+        relay.publish(self.name, AWARENESS, message)
+
+    def receive_remote(self, kind, payload):
+        if kind == UPDATE:
+            self.apply_update(payload, origin=REMOTE)
+        elif kind == AWARENESS:
+            self.awareness.apply(payload, remote=True)
+        elif kind == SYNC_REQUEST:
+            update = self.ydoc.get_update(payload)
+            if update != EMPTY_UPDATE:
+                relay.publish_update(self.name, update)
+
+    async def broadcast(self, message, exclude=None):
+        await _send_all([client for client in self.clients if client is not exclude], message)
+
+    def queue_for_viewers(self, update=None, awareness=None):
+        """Hold an update or awareness message for the next viewer batch."""
+        if not self.viewers:
+            return
+        if update is not None:
+            self._viewer_updates.append(update)
+        if awareness is not None:
+            self._viewer_awareness.append(awareness)
+        if not self._viewer_fan_out_scheduled:
+            self._viewer_fan_out_scheduled = True
+            asyncio.create_task(self._fan_out_viewers())
+
+    def _on_update(self, event):
+        update = event.update
+        if update == EMPTY_UPDATE:
+            return
+
+        self.size += len(update)
+        origin = self._origin
+        if origin is not REMOTE:
+            self.last_active = asyncio.get_running_loop().time()
+            self._pending.append(update)
+            self._has_pending.set()
+            relay.publish_update(self.name, update)
+
+        if not self._outbox:
+            self._outbox_since = asyncio.get_running_loop().time()
+        self._outbox.append((update, origin))
+        if not self._fan_out_scheduled:
+            self._fan_out_scheduled = True
+            asyncio.create_task(self._fan_out())
+        self.queue_for_viewers(update=update)
+
+    async def _fan_out(self):
+        window = settings.YJS_COALESCE_WINDOW_MS / 1000
+        if window:
+            await asyncio.sleep(window)
+
+        self._fan_out_scheduled = False
+        outbox, self._outbox = self._outbox, []
+        if not outbox:
+            return
+        delay = asyncio.get_running_loop().time() - self._outbox_since
+
+        metrics.counter("yjs_updates_in_total").inc(len(outbox))
+        if not window:
+            for update, origin in outbox:
+                await self.broadcast(create_update_message(update), exclude=origin)
+            metrics.counter("yjs_frames_out_total").inc(len(outbox))
+            return
+
+        # one merged frame; a socket receiving its own edits back just ignores them
+        origins = {origin for _, origin in outbox}
+        updates = [update for update, _ in outbox]
+        merged = updates[0] if len(updates) == 1 else merge_updates(*updates)
+        await self.broadcast(create_update_message(merged), exclude=origins.pop() if len(origins) == 1 else None)
+
+        metrics.counter("yjs_frames_out_total").inc()
+        metrics.histogram("yjs_coalesce_batch_size", buckets=(1, 2, 5, 10, 25, 50, 100, 250)).observe(len(outbox))
+        metrics.histogram("yjs_coalesce_delay_seconds").observe(delay)
+
+    async def _fan_out_viewers(self):
+        await asyncio.sleep(settings.YJS_VIEWER_FLUSH_INTERVAL)
+
+        self._viewer_fan_out_scheduled = False
+        updates, self._viewer_updates = self._viewer_updates, []
+        messages, self._viewer_awareness = self._viewer_awareness, []
+        if updates:
+            merged = updates[0] if len(updates) == 1 else merge_updates(*updates)
+            messages.insert(0, create_update_message(merged))
+
+        viewers = list(self.viewers)
+        for message in messages:
+            await _send_all(viewers, message)
+        metrics.counter("yjs_viewer_frames_out_total").inc(len(messages) * len(viewers))
+
+    async def _write_loop(self):
+        while True:
+            await self._has_pending.wait()
+            await self._flush()
+
+            if self.store.tail_length >= settings.YJS_SNAPSHOT_EVERY:
+                await self._snapshot()
+
+    async def _snapshot(self):
+        # a plain fold keeps deleted content around; once enough was written, compact instead
+        try:
+            if self._written >= settings.YJS_COMPACT_AFTER_BYTES:
+                before, after = await self.store.compact()
+                self._written = 0
+                logger.info("Compacted Yjs room %s from %d to %d bytes", self.name, before, after)
+            else:
+                await self.store.snapshot()
+        except Exception:
+            logger.exception("Could not snapshot Yjs room %s", self.name)
+
+    async def _flush(self):
+        self._has_pending.clear()
+        if not self._pending:
+            return
+
+        updates, self._pending = self._pending, []
+        try:
+            await self.store.write_many(updates)
+            self._written += sum(len(update) for update in updates)
+        except Exception:
+            # keep them for the next round instead of losing edits
+            logger.exception("Could not persist %d updates for Yjs room %s", len(updates), self.name)
+            self._pending[:0] = updates
+            await asyncio.sleep(1)
+            self._has_pending.set()
+
+
+async def _send_all(clients, message):
+    if clients:
+        await asyncio.gather(
+            *(client.send(bytes_data=message) for client in clients), return_exceptions=True
+        )
+
+
+async def join_room(name, consumer, viewer=False):
+    """
+    Get the resident room for a share token, loading it from the store if needed;
+    concurrent joins of a room that is still loading wait on the same load.
+    `viewer` joins the consumer as a read-only viewer.
+    """
+    room = _rooms.get(name)
+    if room is None:
+        room = _rooms[name] = YjsRoom(name)
+        room.loading = asyncio.ensure_future(room.start())
+
+    try:
+        await asyncio.shield(room.loading)
+    except Exception:
+        if _rooms.get(name) is room:
+            del _rooms[name]
+        raise
+
+    (room.viewers if viewer else room.clients).add(consumer)
+    room.idle_since = None
+    room.last_active = asyncio.get_running_loop().time()
+    _start_evictor()
+    if _over_budget():
+        asyncio.create_task(evict_rooms())
+    return room
+
+
+async def leave_room(room, consumer):
+    """Detach a consumer; the last one out leaves the room idle until it is evicted."""
+    room.clients.discard(consumer)
+    room.viewers.discard(consumer)
+    room.awareness.remove_client(consumer)
+    if room.occupied or _rooms.get(room.name) is not room:
+        return
+
+    room.idle_since = room.last_active = asyncio.get_running_loop().time()
+    if settings.YJS_ROOM_IDLE_TIMEOUT <= 0:
+        await unload_room(room)
+
+
+async def unload_room(room):
+    """Flush a room to the store and drop it from this process."""
+    if _rooms.get(room.name) is not room:
+        return
+
+    del _rooms[room.name]
+    closing = _closing[room.name] = asyncio.ensure_future(room.stop())
+    try:
+        await asyncio.shield(closing)
+    finally:
+        if _closing.get(room.name) is closing:
+            del _closing[room.name]
+
+
+def _idle_rooms():
+    return [
+        room for room in _rooms.values()
+        if not room.occupied and room.idle_since is not None and room.loading.done()
+    ]
+
+
+def _over_budget():
+    budget = settings.YJS_ROOM_MEMORY_BUDGET_MB * 1024 * 1024
+    return budget > 0 and sum(room.size for room in _rooms.values()) > budget
+
+
+async def evict_rooms():
+    """Unload rooms idle for too long, then idle rooms in LRU order while over the memory budget."""
+    now = asyncio.get_running_loop().time()
+    for room in _idle_rooms():
+        # a client may have joined while the previous room was flushing
+        if not room.occupied and now - room.idle_since >= settings.YJS_ROOM_IDLE_TIMEOUT:
+            await unload_room(room)
+            metrics.counter("yjs_rooms_evicted_total", reason="idle").inc()
+
+    # rooms with clients are never evicted, even over budget
+    for room in sorted(_idle_rooms(), key=lambda room: room.last_active):
+        if not _over_budget():
+            break
+        if room.occupied:
+            continue
+        await unload_room(room)
+        metrics.counter("yjs_rooms_evicted_total", reason="memory").inc()
+
+    _update_room_metrics()
+
+
+async def _evict_loop():
+    while True:
+        await asyncio.sleep(settings.YJS_ROOM_EVICT_INTERVAL)
+        try:
+            await evict_rooms()
+        except Exception:
+            logger.exception("Could not evict idle Yjs rooms")
+
+
+_evictor = None
+
+
+def _start_evictor():
+    global _evictor
+    if _evictor is None or _evictor.done():
+        _evictor = asyncio.create_task(_evict_loop())
+
+
+def _update_room_metrics():
+    stats = room_stats()
+    metrics.gauge("yjs_rooms_resident").set(stats["resident"])
+    metrics.gauge("yjs_rooms_idle").set(stats["idle"])
+    metrics.gauge("yjs_rooms_bytes").set(stats["bytes"])
+
+
+def room_stats():
+    """Resident rooms of this process with their approximate sizes in bytes."""
+    now = asyncio.get_running_loop().time()
+    rooms = [
+        {
+            "name": room.name,
+            "clients": len(room.clients),
+            "viewers": len(room.viewers),
+            "bytes": room.size,
+            "idle_seconds": now - room.idle_since if room.idle_since is not None else 0,
+        }
+        for room in _rooms.values()
+    ]
+    return {
+        "resident": len(rooms),
+        "idle": sum(1 for room in rooms if not room["clients"] and not room["viewers"]),
+        "bytes": sum(room["bytes"] for room in rooms),
+        "rooms": rooms,
+    }
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from document.models import Document
+from document.ydoc_store import compact_document, stored_size
+
+
+class Command(BaseCommand):
+    help = "Rewrite the stored Yjs history of documents as single compacted snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument("share_tokens", nargs="*", help="Only compact these documents")
+        parser.add_argument(
+            "--min-bytes", type=int, default=0,
+            help="Leave documents whose stored history is smaller than this alone",
+        )
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(
+            Q(ydoc_snapshot__isnull=False) | Q(ydoc_updates__isnull=False)
+        ).distinct()
+        if options["share_tokens"]:
+            documents = documents.filter(share_token__in=options["share_tokens"])
+
+        total_before = total_after = 0
+        for share_token in documents.values_list("share_token", flat=True).iterator():
+            if options["min_bytes"] and stored_size(share_token) < options["min_bytes"]:
+                continue
+
+            before, after = compact_document(share_token)
+            total_before += before
+            total_after += after
+            self.stdout.write(f"{share_token}: {before} -> {after} bytes")
+
+        self.stdout.write(self.style.SUCCESS(f"Compacted {total_before} -> {total_after} bytes"))
+
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 14:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0008_document_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YDocSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.BinaryField()),
+                ('last_update_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ydoc_snapshot', to='document.document', to_field='share_token')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='YDocUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ydoc_updates', to='document.document', to_field='share_token')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -4,6 +4,21 @@ import uuid
 
 User = get_user_model()
 
+
+class DocumentQuerySet(models.QuerySet):
+    def with_write_access(self, user):
+        """
+        Annotates user_can_write: whether `user` may edit each document (its
+        admin, or an approved editor), in the same query as the documents.
+        """
+        return self.annotate(user_can_write=models.ExpressionWrapper(
+            models.Q(admin_id=user.id) | models.Exists(DocumentAccess.objects.filter(
+                document=models.OuterRef("pk"), user_id=user.id, can_edit=True, access_approved=True
+            )),
+            output_field=models.BooleanField(),
+        ))
+
+
 class Document(models.Model):
     admin = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents')
     name = models.CharField(max_length=255)
@@ -13,6 +28,9 @@ class Document(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     summary = models.TextField(blank=True, null=True)
+
+    objects = DocumentQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.id} {self.name} ({self.admin})"
 
@@ -71,3 +89,30 @@ class LiveDocumentUser(models.Model):
     def __str__(self):
         return f"{self.name} active in {self.document.name}"
 
+
+class YDocSnapshot(models.Model):
+    # Compacted Yjs state of a document; log entries up to last_update_id are folded into it
+    document = models.OneToOneField(
+        Document, on_delete=models.CASCADE, to_field='share_token', related_name='ydoc_snapshot'
+    )
+    state = models.BinaryField()
+    last_update_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Snapshot of {self.document_id} ({len(self.state)} bytes)"
+
+
+class YDocUpdate(models.Model):
+    # Append-only log of Yjs updates written after the last snapshot
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, to_field='share_token', related_name='ydoc_updates'
+    )
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Update {self.id} for {self.document_id} ({len(self.data)} bytes)"
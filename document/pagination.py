@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DocumentCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the document list, most recently updated first.
+
+    Opt-in: the list is only paginated when the client asks for a page size
+    (?page_size=50), then follows the next/previous cursors of the response.
+    """
+    ordering = ("-updated_at", "-id")
+    page_size = None
+    page_size_query_param = "page_size"
+    max_page_size = 200
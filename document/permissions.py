@@ -12,7 +12,7 @@ class IsAdminOfDocument(BasePermission):
     def has_object_permission(self, request, view, obj):
         # Direct object-level check for Document
         if isinstance(obj, Document):
-            return obj.admin == request.user
+            return obj.admin_id == request.user.id
         return False
 
     def has_permission(self, request, view):
@@ -20,7 +20,7 @@ class IsAdminOfDocument(BasePermission):
         if access_id:
             try:
                 access = DocumentAccess.objects.select_related("document").get(id=access_id)
-                return access.document.admin == request.user
+                return access.document.admin_id == request.user.id
             except DocumentAccess.DoesNotExist:
                 return False
 
@@ -37,6 +37,6 @@ class IsCommentOwner(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         if isinstance(obj, Comment):
-            return obj.user == request.user
+            return obj.user_id == request.user.id
 
         return False
\ No newline at end of file
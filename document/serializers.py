@@ -1,13 +1,73 @@
-from redis import Redis
+import redis
 
-from django.conf import settings
+from django.db import models
 from rest_framework import serializers
 
 from user_auth.serializers import UserSerializer
+from utils.redis_client import get_redis
 from utils.redis_key_generator import get_key_for_document
 from .models import Document, DocumentAccess, Comment
 
-class DocumentSerializer(serializers.ModelSerializer):
+
+def fetch_live_members_counts(documents):
+    """
+    share_token -> live member count of the live documents among `documents`,
+    with all the SCARDs in one pipeline. Counts are 0 if Redis is unavailable.
+    """
+    share_tokens = list({str(document.share_token) for document in documents if document.is_live})
+    if not share_tokens:
+        return {}
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for share_token in share_tokens:
+            pipe.scard(get_key_for_document(share_token))
+        return dict(zip(share_tokens, pipe.execute()))
+    except redis.RedisError:
+        return dict.fromkeys(share_tokens, 0)
+
+
+class DocumentListSerializer(serializers.ListSerializer):
+    """
+    Fetches the live member counts of the whole list up front, so rendering it
+    costs one Redis round trip instead of one per document.
+    """
+    def get_documents(self, items):
+        return items
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.context["live_members_counts"] = fetch_live_members_counts(self.get_documents(items))
+        return super().to_representation(items)
+
+
+class DocumentAccessListSerializer(DocumentListSerializer):
+    def get_documents(self, accesses):
+        return [access.document for access in accesses]
+
+
+class SparseFieldsetMixin:
+    """
+    Leaves out every field not named in ?fields=id,name,... when rendering the
+    response of a GET. Only applies to the serializer of the response itself
+    (or of its items), not to serializers nested in it.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if request is None or request.method != "GET" or not request.query_params.get("fields"):
+            return fields
+
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+
+        requested = {name.strip() for name in request.query_params["fields"].split(",")}
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class DocumentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     live_members_count = serializers.SerializerMethodField()
     can_write_access = serializers.SerializerMethodField()  # ✅ Add this
 
@@ -18,15 +78,19 @@ class DocumentSerializer(serializers.ModelSerializer):
             'admin', 'created_at', 'updated_at', 'share_token', 'summary',
             'live_members_count', 'can_write_access'
         ]
+        list_serializer_class = DocumentListSerializer
 
     def get_live_members_count(self, obj):
         if not obj.is_live:
             return 0
-        redis = Redis.from_url(settings.REDIS_URL)
+        # prefetched when serializing a list (see DocumentListSerializer)
+        counts = self.context.get("live_members_counts")
+        if counts is not None:
+            return counts.get(str(obj.share_token), 0)
         key: str = get_key_for_document(obj.share_token)
         try:
-            return redis.scard(key)
-        except redis.exceptions.ConnectionError:
+            return get_redis().scard(key)
+        except redis.RedisError:
             return 0
 
     def get_can_write_access(self, obj):
@@ -36,14 +100,28 @@ class DocumentSerializer(serializers.ModelSerializer):
             return False
 
         user = request.user
+        # annotated by Document.objects.with_write_access(user)
+        if hasattr(obj, "user_can_write"):
+            return obj.user_can_write
+
         # Admin always has write access
-        if obj.admin == user:
+        if obj.admin_id == user.id:
             return True
 
         # Check DocumentAccess.can_edit
         return obj.accesses.filter(user=user, can_edit=True, access_approved=True).exists()
 
 
+class DocumentListItemSerializer(DocumentSerializer):
+    """
+    A document in GET /api/documents/: everything but content and summary,
+    which the list defers and only the detail endpoint returns.
+    """
+    class Meta(DocumentSerializer.Meta):
+        fields = None
+        exclude = ['content', 'summary']
+
+
 class DocumentAccessSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     document = DocumentSerializer(read_only=True)
@@ -52,6 +130,7 @@ class DocumentAccessSerializer(serializers.ModelSerializer):
         model = DocumentAccess
         fields = "__all__"
         read_only_fields = ['request_at', 'approved_at']
+        list_serializer_class = DocumentAccessListSerializer
 
 class CommentSerializer(serializers.ModelSerializer):
     user = serializers.SerializerMethodField(read_only=True)
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from document.models import Document
+from utils.document_cache import publish_invalidation
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def invalidate_cached_document(sender, instance, **kwargs):
+    # is_live / admin may have changed; every process refetches on next use
+    publish_invalidation(instance.share_token)
@@ -1,3 +1,124 @@
+import fakeredis
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from document.models import Document, DocumentAccess
+from user_auth.models import CustomUser
+from utils import redis_client
+from utils.redis_key_generator import get_key_for_document
+
+
+class DocumentListQueryTests(TestCase):
+    """Listing documents and accesses costs a fixed number of queries, however many rows there are."""
+
+    @classmethod
+    def setUpClass(cls):
+        # saving a document publishes a cache invalidation, so Redis is needed from the start
+        redis_client.use_clients(fakeredis.FakeRedis(), fakeredis.aioredis.FakeRedis())
+        cls.addClassCleanup(redis_client.use_clients, None, None)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email="admin@example.com", password="x", first_name="Admin")
+        cls.editor = CustomUser.objects.create_user(email="editor@example.com", password="x", first_name="Editor")
+        members = CustomUser.objects.bulk_create([
+            CustomUser(email=f"member-{i}@example.com", first_name="Member") for i in range(5)
+        ])
+        cls.documents = Document.objects.bulk_create([
+            Document(admin=cls.admin, name=f"doc {i}", is_live=i % 2 == 0) for i in range(20)
+        ])
+        DocumentAccess.objects.bulk_create([
+            DocumentAccess(document=document, user=member, can_edit=True, access_approved=True)
+            for document in cls.documents for member in members
+        ])
+        cls.shared = Document.objects.create(admin=cls.admin, name="shared", is_live=True)
+        DocumentAccess.objects.create(document=cls.shared, user=cls.editor, can_edit=True, access_approved=True)
+
+    def setUp(self):
+        self.redis = redis_client.get_redis()
+        self.redis.flushall()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_document_list(self):
+        self.redis.sadd(get_key_for_document(self.documents[0].share_token), "1", "2")
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/documents/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 21)
+        self.assertTrue(all(document["can_write_access"] for document in response.data))
+        counts = {document["id"]: document["live_members_count"] for document in response.data}
+        self.assertEqual(counts[self.documents[0].id], 2)
+        self.assertEqual(counts[self.documents[1].id], 0)
+
+    def test_document_access_list(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/document_access/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 101)
+        self.assertTrue(all(access["document"]["can_write_access"] for access in response.data))
+        self.assertEqual(
+            {access["user"]["email"] for access in response.data if access["document"]["id"] == self.shared.id},
+            {"editor@example.com"},
+        )
+
+    def test_write_access_annotation(self):
+        documents = Document.objects.with_write_access(self.editor)
+        self.assertTrue(documents.get(id=self.shared.id).user_can_write)
+        self.assertFalse(documents.get(id=self.documents[0].id).user_can_write)
+
+
+class DocumentListModeTests(TestCase):
+    """The document list leaves out content and summary, and supports ?fields= and keyset pages."""
+
+    @classmethod
+    def setUpClass(cls):
+        redis_client.use_clients(fakeredis.FakeRedis(), fakeredis.aioredis.FakeRedis())
+        cls.addClassCleanup(redis_client.use_clients, None, None)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user(email="admin@example.com", password="x", first_name="Admin")
+        cls.documents = Document.objects.bulk_create([
+            Document(admin=cls.admin, name=f"doc {i}", content="x" * 10000, summary="y" * 1000) for i in range(25)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_list_defers_content(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/documents/")
+
+        self.assertEqual(len(response.data), 25)
+        self.assertNotIn("content", response.data[0])
+        self.assertNotIn("summary", response.data[0])
+        self.assertNotIn('"content"', queries.captured_queries[-1]["sql"])
+
+        response = self.client.get(f"/api/documents/{self.documents[0].id}/")
+        self.assertEqual(len(response.data["content"]), 10000)
+
+    def test_sparse_fieldset(self):
+        response = self.client.get("/api/documents/?fields=id,name")
+        self.assertEqual(set(response.data[0]), {"id", "name"})
+
+        response = self.client.get(f"/api/documents/{self.documents[0].id}/?fields=id,content")
+        self.assertEqual(set(response.data), {"id", "content"})
+
+    def test_keyset_pages(self):
+        seen = []
+        url = "/api/documents/?page_size=10&fields=id"
+        while url:
+            response = self.client.get(url)
+            seen.extend(document["id"] for document in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(seen, [document.id for document in reversed(self.documents)])
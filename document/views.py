@@ -1,4 +1,8 @@
+import gzip
+
 from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.utils.http import parse_etags, quote_etag
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.generics import ListCreateAPIView, UpdateAPIView
@@ -15,9 +19,13 @@ from channels.layers import get_channel_layer
 
 from .models import Document, DocumentAccess, Comment, LiveDocumentUser
 from .permissions import IsAdminOfDocument, IsCommentOwner
-from .serializers import DocumentSerializer, CommentSerializer, DocumentAccessSerializer
+from .pagination import DocumentCursorPagination
+from .serializers import DocumentSerializer, DocumentListItemSerializer, CommentSerializer, DocumentAccessSerializer
+from consumers.fanout import group_send
 from utils.ws_groups import generate_group_name_from_user_id
-from utils.db_helper import get_document_or_404, get_document_access_or_404, get_document_by_share_token_or_404
+from .ydoc_store import EMPTY_UPDATE, load_document_state, merge_stored_state, stored_version
+from utils.db_helper import get_document_or_404, get_document_access_or_404, get_document_by_share_token_or_404, \
+    get_document_info_by_share_token_or_404
 
 import uuid
 
@@ -30,7 +38,8 @@ class DocumentAccessViewSet(ModelViewSet):
     filterset_fields = ['document', 'access_requested', 'access_approved']
 
     def get_queryset(self):
-        return DocumentAccess.objects.filter(document__admin=self.request.user)
+        # the nested user and document come from the same query (see DocumentAccessSerializer)
+        return DocumentAccess.objects.filter(document__admin=self.request.user).select_related("user", "document")
 
     @action(detail=False, methods=["post"], url_path="grant-access")
     def grant_access(self, request):
@@ -88,9 +97,19 @@ class DocumentAccessViewSet(ModelViewSet):
 class DocumentViewSet(ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [IsAuthenticated, IsAdminOfDocument]
+    pagination_class = DocumentCursorPagination
 
     def get_queryset(self):
-        return Document.objects.filter(admin=self.request.user)
+        documents = Document.objects.filter(admin=self.request.user).with_write_access(self.request.user)
+        if self.action == "list":
+            # content and summary can be megabytes each; only the detail endpoint returns them
+            documents = documents.defer("content", "summary").order_by("-updated_at", "-id")
+        return documents
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return DocumentListItemSerializer
+        return super().get_serializer_class()
 
     def perform_create(self, serializer):
         import secrets
@@ -112,6 +131,37 @@ class DocumentViewSet(ModelViewSet):
         serializer = self.get_serializer(document)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=["get"], url_path="by-token/(?P<token>[^/.]+)/snapshot", permission_classes=[IsAuthenticated])
+    def snapshot(self, request, token=None):
+        """
+        The stored Yjs state of a document as one encoded update, so clients can
+        render before the WebSocket sync is done. Edits not persisted yet arrive
+        over the socket afterwards.
+        """
+        document = get_document_info_by_share_token_or_404(share_token=token)
+
+        # same rule as YjsDocumentConsumer.connect
+        if not document.is_live and document.admin_id != request.user.id:
+            return Response({"detail": "Document is not live."}, status=status.HTTP_403_FORBIDDEN)
+
+        etag = quote_etag(stored_version(document.share_token))
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            state = merge_stored_state(*load_document_state(document.share_token)) or EMPTY_UPDATE
+            response = HttpResponse(content_type="application/octet-stream")
+            if "gzip" in request.headers.get("Accept-Encoding", ""):
+                response.content = gzip.compress(state)
+                response["Content-Encoding"] = "gzip"
+            else:
+                response.content = state
+
+        response["ETag"] = etag
+        response["Vary"] = "Accept-Encoding"
+        # always revalidate; a matching ETag costs two small queries
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
 
 class RequestAccessAPIView(APIView):
     permission_classes = [IsAuthenticated]
@@ -119,7 +169,7 @@ class RequestAccessAPIView(APIView):
     def post(self, request, share_token):
         document = get_document_by_share_token_or_404(share_token)
 
-        if document.admin == request.user:
+        if document.admin_id == request.user.id:
             return Response({"detail": "You are the admin of this document."}, status=status.HTTP_400_BAD_REQUEST)
 
         if document.accesses.filter(user=request.user, access_requested=True).exists():
@@ -139,7 +189,7 @@ class RequestAccessAPIView(APIView):
         )
 
         # admin group name to send notification
-        admin_group = generate_group_name_from_user_id(document.admin.id)
+        admin_group = generate_group_name_from_user_id(document.admin_id)
 
         # Send WebSocket notification to admin-only group
         channel_layer = get_channel_layer()
@@ -227,7 +277,7 @@ class CommentListCreateView(ListCreateAPIView):
 
     def get_queryset(self):
         document_id = self.kwargs["document_id"]
-        return Comment.objects.filter(document_id=document_id).order_by("-id")
+        return Comment.objects.filter(document_id=document_id).select_related("user").order_by("-id")
 
     def perform_create(self, serializer):
         document_id = self.kwargs["document_id"]
@@ -238,7 +288,8 @@ class CommentListCreateView(ListCreateAPIView):
         # Broadcast if live
         if document.is_live:
             channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
+            async_to_sync(group_send)(
+                channel_layer,
                 f"doc_{document.share_token}",
                 {
                     "type": "broadcast.comment",
@@ -268,7 +319,8 @@ class CommentUpdateView(UpdateAPIView):
         # Broadcast if live
         if document.is_live:
             channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
+            async_to_sync(group_send)(
+                channel_layer,
                 f"doc_{document.share_token}",
                 {
                     "type": "broadcast.comment",
@@ -292,9 +344,9 @@ class LiveDocumentAccessView(APIView):
         if not share_token:
             return Response({"detail": "Missing share_token", "status": "CAN_NOT_CONNECT"}, status=status.HTTP_400_BAD_REQUEST)
 
-        document = get_document_by_share_token_or_404(share_token)
+        document = get_document_info_by_share_token_or_404(share_token)
 
-        if document.admin == request.user or document.is_live:
+        if document.admin_id == request.user.id or document.is_live:
             return Response({"detail": "Access granted", "status": "CAN_CONNECT"}, status=status.HTTP_200_OK)
         else:
             return Response({"detail": "Document is not live", "status": "CAN_NOT_CONNECT"}, status=status.HTTP_403_FORBIDDEN)
@@ -307,7 +359,7 @@ class LiveDocumentUsersView(APIView):
         document_id = kwargs.get('document_id')
         document = get_document_or_404(document_id)
 
-        is_admin = document.admin == request.user
+        is_admin = document.admin_id == request.user.id
         is_user_in_room = LiveDocumentUser.objects.filter(user=request.user, document_id=document_id).exists()
 
         if not is_admin and not is_user_in_room:
@@ -319,7 +371,7 @@ class LiveDocumentUsersView(APIView):
 
         for l_user in live_users:
             user_data = {
-                "userId": l_user.user.id,
+                "userId": l_user.user_id,
                 "name": l_user.name,
                 "email": l_user.email,
                 "color": l_user.color,
@@ -0,0 +1,171 @@
+"""
+Durable storage for the Yjs documents served by YjsDocumentConsumer.
+
+Every update applied to a room is appended to the YDocUpdate log. Once enough
+updates pile up, the log is folded into the document's YDocSnapshot, so loading
+a room only needs the snapshot plus a short tail of updates.
+
+Folding only merges updates, so the snapshot still carries the content of
+everything ever deleted. compact_document() goes one step further and
+re-encodes the document through a Doc, which garbage-collects deleted
+content; the compact_ydocs command and long-lived rooms use it.
+"""
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.db.models.functions import Length
+from pycrdt import Doc, merge_updates
+
+from document.models import YDocSnapshot, YDocUpdate
+
+EMPTY_UPDATE = b"\x00\x00"
+
+
+def load_document_state(share_token):
+    """
+    Return (snapshot, tail) for a document, where tail is the list of updates
+    written after the snapshot. The snapshot is None when none was taken yet.
+    """
+    snapshot = YDocSnapshot.objects.filter(document_id=share_token).first()
+    updates = YDocUpdate.objects.filter(document_id=share_token)
+    if snapshot is not None:
+        updates = updates.filter(id__gt=snapshot.last_update_id)
+    tail = [bytes(data) for data in updates.values_list("data", flat=True)]
+    return (bytes(snapshot.state) if snapshot else None), tail
+
+
+def merge_stored_state(snapshot, tail):
+    """A single update holding the snapshot and its tail, or None for an empty document."""
+    updates = ([snapshot] if snapshot else []) + tail
+    if not updates:
+        return None
+    return updates[0] if len(updates) == 1 else merge_updates(*updates)
+
+
+def stored_version(share_token):
+    """
+    A string that changes whenever the stored state of a document changes,
+    read without loading the state itself (used as the snapshot ETag).
+    """
+    snapshot = (
+        YDocSnapshot.objects.filter(document_id=share_token)
+        .values_list("last_update_id", "updated_at").first()
+    )
+    last_update_id = YDocUpdate.objects.filter(document_id=share_token).aggregate(Max("id"))["id__max"]
+    if snapshot is None:
+        return f"0-{last_update_id or 0}"
+    # the timestamp moves on compaction, which rewrites the snapshot without new log entries
+    return f"{snapshot[0]}.{int(snapshot[1].timestamp() * 1000000)}-{last_update_id or 0}"
+
+
+def append_updates(share_token, updates):
+    YDocUpdate.objects.bulk_create(
+        [YDocUpdate(document_id=share_token, data=update) for update in updates]
+    )
+
+
+def fold_updates(share_token):
+    """
+    Merge the update log into the snapshot and drop the merged log entries.
+    Updates appended while this runs get higher ids and are left for the next fold.
+    """
+    with transaction.atomic():
+        snapshot, _ = YDocSnapshot.objects.select_for_update().get_or_create(
+            document_id=share_token, defaults={"state": b""}
+        )
+        rows = list(
+            YDocUpdate.objects.filter(document_id=share_token, id__gt=snapshot.last_update_id)
+            .values_list("id", "data")
+        )
+        if not rows:
+            return snapshot
+
+        snapshot.state = merge_stored_state(
+            bytes(snapshot.state), [bytes(data) for _, data in rows]
+        )
+        snapshot.last_update_id = rows[-1][0]
+        snapshot.save(update_fields=["state", "last_update_id", "updated_at"])
+
+        YDocUpdate.objects.filter(document_id=share_token, id__lte=snapshot.last_update_id).delete()
+        return snapshot
+
+
+def stored_size(share_token):
+    """Bytes of Yjs history stored for a document, snapshot and log together."""
+    snapshot = YDocSnapshot.objects.filter(document_id=share_token).aggregate(size=Sum(Length("state")))
+    updates = YDocUpdate.objects.filter(document_id=share_token).aggregate(size=Sum(Length("data")))
+    return (snapshot["size"] or 0) + (updates["size"] or 0)
+
+
+def compact_state(updates):
+    """Re-encode updates through a Doc, which drops the content of deleted items."""
+    doc = Doc()
+    with doc.transaction():
+        for update in updates:
+            doc.apply_update(update)
+    return doc.get_update()
+
+
+def compact_document(share_token):
+    """
+    Rewrite the stored snapshot and update log of a document as a single
+    compacted snapshot. Returns the stored size in bytes before and after.
+
+    Safe while the room is live: the snapshot row is locked the same way
+    fold_updates() locks it, and updates appended meanwhile get higher ids
+    and stay in the log.
+    """
+    with transaction.atomic():
+        snapshot, _ = YDocSnapshot.objects.select_for_update().get_or_create(
+            document_id=share_token, defaults={"state": b""}
+        )
+        rows = list(YDocUpdate.objects.filter(document_id=share_token).values_list("id", "data"))
+        before = len(snapshot.state) + sum(len(data) for _, data in rows)
+
+        updates = [bytes(snapshot.state)] if snapshot.state else []
+        updates += [bytes(data) for id_, data in rows if id_ > snapshot.last_update_id]
+        if not updates:
+            return before, before
+
+        snapshot.state = compact_state(updates)
+        if rows:
+            snapshot.last_update_id = max(snapshot.last_update_id, rows[-1][0])
+        snapshot.save(update_fields=["state", "last_update_id", "updated_at"])
+
+        YDocUpdate.objects.filter(document_id=share_token, id__lte=snapshot.last_update_id).delete()
+        return before, len(snapshot.state)
+
+
+class DjangoYStore:
+    """
+    The stored Yjs history of one document, in the YDocSnapshot / YDocUpdate
+    tables, keyed by share token.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        # number of log entries not yet folded into the snapshot
+        self.tail_length = 0
+
+    async def read_state(self):
+        """The whole stored document as one update, or None if nothing was stored yet."""
+        snapshot, tail = await sync_to_async(load_document_state)(self.path)
+        self.tail_length = len(tail)
+        return merge_stored_state(snapshot, tail)
+
+    async def write_many(self, updates):
+        updates = [update for update in updates if update != EMPTY_UPDATE]
+        if not updates:
+            return
+        await sync_to_async(append_updates)(self.path, updates)
+        self.tail_length += len(updates)
+
+    async def snapshot(self):
+        await sync_to_async(fold_updates)(self.path)
+        self.tail_length = 0
+
+    async def compact(self):
+        """Like snapshot(), but garbage-collects deleted content. Returns (before, after) sizes."""
+        sizes = await sync_to_async(compact_document)(self.path)
+        self.tail_length = 0
+        return sizes
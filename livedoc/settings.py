@@ -136,6 +136,13 @@ REST_FRAMEWORK = {
 }
 
 REDIS_URL = config("REDIS_URL")
+# Pooled clients of utils.redis_client: connections per pool, seconds to wait for a free one,
+# socket timeouts, and how long a connection may sit idle before it is PINGed on reuse
+REDIS_MAX_CONNECTIONS = config("REDIS_MAX_CONNECTIONS", default=50, cast=int)
+REDIS_POOL_TIMEOUT = config("REDIS_POOL_TIMEOUT", default=5.0, cast=float)
+REDIS_SOCKET_TIMEOUT = config("REDIS_SOCKET_TIMEOUT", default=5.0, cast=float)
+REDIS_CONNECT_TIMEOUT = config("REDIS_CONNECT_TIMEOUT", default=2.0, cast=float)
+REDIS_HEALTH_CHECK_INTERVAL = config("REDIS_HEALTH_CHECK_INTERVAL", default=30, cast=int)
 # Channels
 CHANNEL_LAYERS = {
     "default": {
@@ -146,6 +153,49 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Yjs persistence: fold the update log into a snapshot after this many updates
+YJS_SNAPSHOT_EVERY = config("YJS_SNAPSHOT_EVERY", default=200, cast=int)
+# ...and compact it (dropping deleted content) once a room wrote this many bytes since the last compaction
+YJS_COMPACT_AFTER_BYTES = config("YJS_COMPACT_AFTER_BYTES", default=1024 * 1024, cast=int)
+# Write-behind of the Yjs document body into Document.content ("xml" for XmlFragment, "text" for Y.Text)
+YJS_CONTENT_ROOT = config("YJS_CONTENT_ROOT", default="default")
+YJS_CONTENT_TYPE = config("YJS_CONTENT_TYPE", default="xml")
+YJS_CONTENT_FLUSH_INTERVAL = config("YJS_CONTENT_FLUSH_INTERVAL", default=5.0, cast=float)
+# Merge outgoing Yjs updates of a room over this window before fanning them out (0 = one frame per update)
+YJS_COALESCE_WINDOW_MS = config("YJS_COALESCE_WINDOW_MS", default=0, cast=int)
+# Awareness (cursors/selections): flush dirty states at most this often per room, resend unchanged
+# states every RENEW_INTERVAL seconds, forget states nobody renewed for TIMEOUT seconds
+YJS_AWARENESS_FLUSH_INTERVAL = config("YJS_AWARENESS_FLUSH_INTERVAL", default=0.1, cast=float)
+YJS_AWARENESS_RENEW_INTERVAL = config("YJS_AWARENESS_RENEW_INTERVAL", default=15.0, cast=float)
+YJS_AWARENESS_TIMEOUT = config("YJS_AWARENESS_TIMEOUT", default=30.0, cast=float)
+# Rooms without clients stay loaded this many seconds (0 unloads them right away)
+YJS_ROOM_IDLE_TIMEOUT = config("YJS_ROOM_IDLE_TIMEOUT", default=300.0, cast=float)
+# Idle rooms are evicted LRU first while a worker holds more than this (0 = no limit)
+YJS_ROOM_MEMORY_BUDGET_MB = config("YJS_ROOM_MEMORY_BUDGET_MB", default=256, cast=int)
+YJS_ROOM_EVICT_INTERVAL = config("YJS_ROOM_EVICT_INTERVAL", default=30.0, cast=float)
+# Read-only sockets get the room's updates merged into one frame this often
+YJS_VIEWER_FLUSH_INTERVAL = config("YJS_VIEWER_FLUSH_INTERVAL", default=0.5, cast=float)
+
+
+# Live document presence: each socket renews its entry every HEARTBEAT_INTERVAL seconds,
+# entries not renewed for TTL seconds are removed by the reaper (checked every REAP_INTERVAL)
+PRESENCE_TTL = config("PRESENCE_TTL", default=60, cast=int)
+PRESENCE_HEARTBEAT_INTERVAL = config("PRESENCE_HEARTBEAT_INTERVAL", default=20.0, cast=float)
+PRESENCE_REAP_INTERVAL = config("PRESENCE_REAP_INTERVAL", default=15.0, cast=float)
+# Joins and leaves of a document within this many seconds share one member-count broadcast
+LIVE_MEMBER_COUNT_WINDOW = config("LIVE_MEMBER_COUNT_WINDOW", default=0.25, cast=float)
+# Live user lists are cached in Redis for this long; online flags reach the database in batches this often
+LIVE_USERS_CACHE_TTL = config("LIVE_USERS_CACHE_TTL", default=86400, cast=int)
+LIVE_USER_FLUSH_INTERVAL = config("LIVE_USER_FLUSH_INTERVAL", default=2.0, cast=float)
+# share_token -> (id, admin_id, is_live) cache per process, invalidated over Redis pub/sub
+DOCUMENT_CACHE_SIZE = config("DOCUMENT_CACHE_SIZE", default=10000, cast=int)
+DOCUMENT_CACHE_TTL = config("DOCUMENT_CACHE_TTL", default=60, cast=int)
+# Outgoing frames queued per socket before the client counts as too slow, and the longest a single send may take
+WS_SEND_QUEUE_SIZE = config("WS_SEND_QUEUE_SIZE", default=100, cast=int)
+WS_SEND_TIMEOUT = config("WS_SEND_TIMEOUT", default=10.0, cast=float)
+# Lets a scraper read /api/metrics/ without a staff login (X-Metrics-Token header); empty disables it
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
 
 # Simple JWT
 SIMPLE_JWT = {
@@ -0,0 +1,38 @@
+"""
+Settings for the test suite: SQLite, an in-memory channel layer and dummy
+credentials, so the tests run offline. Redis is replaced with fakeredis by
+the tests themselves (see utils.redis_client.use_clients).
+
+    python manage.py test --settings=livedoc.test_settings
+"""
+import os
+
+for name in (
+    "SECRET_KEY", "DB_NAME", "DB_USER", "DB_PASSWORD", "DB_HOST", "DB_PORT",
+    "EMAIL_HOST_USER", "EMAIL_HOST_PASSWORD", "GOOGLE_OAUTH2_CLIENT_ID", "GOOGLE_OAUTH2_CLIENT_SECRET",
+    "GEMINI_API_KEY", "LIVEBLOCKS_SECRET_KEY",
+):
+    os.environ.setdefault(name, "test")
+for name in ("CSRF_TRUSTED_ORIGINS", "CSRF_ALLOWED_ORIGINS", "CORS_ALLOWED_ORIGINS"):
+    os.environ.setdefault(name, "http://testserver")
+os.environ.setdefault("ALLOWED_HOSTS", "testserver")
+os.environ.setdefault("DEBUG", "False")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+from livedoc.settings import *  # noqa: E402,F401,F403
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    }
+}
+
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    },
+}
+
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
@@ -1,3 +1,94 @@
-from django.test import TestCase
+import fakeredis
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from consumers.document_consumer import send_member_count
+from document.models import Document
+from document.routing import websocket_urlpatterns
+from user_auth.models import CustomUser
+from utils import redis_client
+
+
+class AsUser:
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        scope["user"] = self.user
+        return await self.app(scope, receive, send)
+
+
+@override_settings(LIVE_MEMBER_COUNT_WINDOW=60)
+class LiveMemberCountWatchTests(TestCase):
+    """A notification socket follows the member count of every live document its user has a socket in."""
+
+    @classmethod
+    def setUpClass(cls):
+        redis_client.use_clients(fakeredis.FakeRedis(), fakeredis.aioredis.FakeRedis())
+        cls.addClassCleanup(redis_client.use_clients, None, None)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email="member@example.com", password="x", first_name="Member")
+        cls.document = Document.objects.create(admin=cls.user, name="live", is_live=True)
+
+    def setUp(self):
+        redis_client.get_redis().flushall()
+        self.app = AsUser(URLRouter(websocket_urlpatterns), self.user)
+
+    async def open(self, path):
+        communicator = WebsocketCommunicator(self.app, path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # CONNECTED, or the live users list once the document socket is done joining
+        await communicator.receive_json_from()
+        return communicator
+
+    async def open_document(self):
+        return await self.open(f"/ws/documents/{self.document.share_token}/")
+
+    async def open_notifications(self):
+        return await self.open(f"/ws/notifications/{self.user.id}/")
+
+    async def counts(self, communicator):
+        received = []
+        while not await communicator.receive_nothing(timeout=0.1):
+            message = await communicator.receive_json_from()
+            if message["type"] == "LIVE_MEMBER_COUNT":
+                received.append(message["count"])
+        return received
+
+    async def broadcast_count(self, count):
+        await send_member_count(get_channel_layer(), self.document.share_token, self.document.id, count)
+
+    async def test_reconnect_watches_joined_documents(self):
+        document = await self.open_document()
+        # the notification socket (re)connects after the user joined the document
+        notifications = await self.open_notifications()
+
+        await self.broadcast_count(1)
+        self.assertEqual(await self.counts(notifications), [1])
+
+        await document.disconnect()
+        await notifications.disconnect()
+
+    async def test_unwatch_on_last_socket(self):
+        notifications = await self.open_notifications()
+        first = await self.open_document()
+        second = await self.open_document()
+
+        await first.disconnect()
+        await self.counts(notifications)
+        await self.broadcast_count(1)
+        self.assertEqual(await self.counts(notifications), [1])
+
+        await second.disconnect()
+        await self.counts(notifications)
+        await self.broadcast_count(0)
+        self.assertEqual(await self.counts(notifications), [])
+
+        await notifications.disconnect()
@@ -6,12 +6,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
-from redis import Redis
-from django.conf import settings
-
 from user_auth.models import CustomUser
 from user_auth.serializers import UserUpdateSerializer, PasswordChangeSerializer, UserSerializer, UserMetaSerializer, LiveUsersSerializer
-from utils.redis_key_generator import get_key_for_document
+from utils.redis_client import get_redis
+from utils.redis_key_generator import get_key_for_document, get_key_for_document_user
 
 User = get_user_model();
 # api view to get user details
@@ -118,15 +116,17 @@ class GetLiveUsersEmailsView(APIView):
         if not share_token:
             return Response({"detail": "Missing 'share_token' query parameter."}, status=400)
 
-        redis = Redis.from_url(settings.REDIS_URL)
+        redis = get_redis()
         users = []
 
-        user_ids = redis.smembers(get_key_for_document(share_token))
+        user_ids = list(redis.smembers(get_key_for_document(share_token)))
 
+        # every member's details in one round trip
+        pipe = redis.pipeline(transaction=False)
         for user_id in user_ids:
-            key = f"doc:{share_token}:user:{user_id.decode()}"
-            user_data = redis.hgetall(key)
+            pipe.hgetall(get_key_for_document_user(share_token, user_id.decode()))
 
+        for user_id, user_data in zip(user_ids, pipe.execute()):
             # Decode all fields
             user = {
                 "id": int(user_id),
@@ -1,6 +1,7 @@
 # utils/db_helpers.py
 from rest_framework.exceptions import NotFound
 from document.models import Document, DocumentAccess
+from utils.document_cache import get_document_info
 
 def get_document_or_404(document_id):
     try:
@@ -14,6 +15,13 @@ def get_document_by_share_token_or_404(share_token):
     except Document.DoesNotExist:
         raise NotFound(detail="Document not found with the provided share token.")
 
+def get_document_info_by_share_token_or_404(share_token):
+    """Cached id / admin_id / is_live of a document, for checks that don't need the whole row."""
+    try:
+        return get_document_info(share_token)
+    except Document.DoesNotExist:
+        raise NotFound(detail="Document not found with the provided share token.")
+
 def get_document_access_or_404(access_id):
     try:
         return DocumentAccess.objects.get(id=access_id)
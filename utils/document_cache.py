@@ -0,0 +1,120 @@
+"""
+Process-local cache of share_token -> DocumentInfo(id, share_token, admin_id, is_live).
+
+Handshakes and access checks only need these fields, so they are kept in a
+TTL + LRU cache (DOCUMENT_CACHE_SIZE entries for DOCUMENT_CACHE_TTL seconds)
+instead of fetching the row every time. When a document is saved or
+deleted, the post_save/post_delete handlers in document.signals drop it here
+and publish its share token on get_channel_for_document_invalidation(), and
+every process listening there drops its copy too.
+
+Entries are only cached while this process is subscribed, so a missed
+invalidation can't leave them stale for longer than the TTL. A row read
+while an invalidation came in is returned but not cached, as it may predate
+the change.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from cachetools import TTLCache
+from django.conf import settings
+
+from document.models import Document
+from utils import metrics
+from utils.redis_client import get_redis
+from utils.redis_key_generator import get_channel_for_document_invalidation
+
+logger = logging.getLogger(__name__)
+
+DocumentInfo = namedtuple("DocumentInfo", ["id", "share_token", "admin_id", "is_live"])
+
+_cache = TTLCache(maxsize=settings.DOCUMENT_CACHE_SIZE, ttl=settings.DOCUMENT_CACHE_TTL)
+_lock = threading.Lock()
+# bumped by every invalidation, so a miss can tell whether one raced its database read
+_generation = 0
+
+_listener = None
+_listener_retry_at = 0.0
+
+
+def get_document_info(share_token):
+    """The DocumentInfo of a share token; raises Document.DoesNotExist like Document.objects.get."""
+    key = str(share_token)
+    with _lock:
+        info = _cache.get(key)
+        generation = _generation
+    if info is not None:
+        metrics.counter("document_cache_hits_total").inc()
+        return info
+
+    metrics.counter("document_cache_misses_total").inc()
+    row = Document.objects.filter(share_token=share_token).values_list("id", "share_token", "admin_id", "is_live").first()
+    if row is None:
+        raise Document.DoesNotExist
+    info = DocumentInfo(*row)
+
+    if _listening():
+        with _lock:
+            if _generation == generation:
+                _cache[key] = info
+    return info
+
+
+def invalidate(share_token):
+    global _generation
+    with _lock:
+        _cache.pop(str(share_token), None)
+        _generation += 1
+
+
+def clear():
+    """Drop every document cached by this process."""
+    global _generation
+    with _lock:
+        _cache.clear()
+        _generation += 1
+
+
+def publish_invalidation(share_token):
+    """Drop a document here and in every other process."""
+    invalidate(share_token)
+    try:
+        get_redis().publish(get_channel_for_document_invalidation(), str(share_token))
+    except Exception:
+        logger.exception("Could not publish invalidation of document %s", share_token)
+
+
+def _on_invalidation(message):
+    invalidate(message["data"].decode())
+
+
+def _on_listener_error(error, pubsub, thread):
+    # the thread keeps going and reconnects; what was cached meanwhile may have missed updates
+    logger.warning("Document cache listener error: %s", error)
+    clear()
+
+
+def _listening():
+    """Start the invalidation listener of this process if needed; False while it can't run."""
+    global _listener, _listener_retry_at
+    if _listener is not None and _listener.is_alive():
+        return True
+
+    with _lock:
+        if _listener is not None and _listener.is_alive():
+            return True
+        if time.monotonic() < _listener_retry_at:
+            return False
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{get_channel_for_document_invalidation(): _on_invalidation})
+            _listener = pubsub.run_in_thread(
+                sleep_time=1.0, daemon=True, exception_handler=_on_listener_error
+            )
+            return True
+        except Exception:
+            logger.exception("Could not subscribe to document invalidations, not caching")
+            _listener_retry_at = time.monotonic() + 30
+            return False
@@ -0,0 +1,241 @@
+"""
+Everyone who joined a live document, with their color and online flag.
+
+Served from a Redis hash per document (get_key_for_document_live_users) of
+user id -> JSON entry, filled from LiveDocumentUser the first time a worker
+needs it. Connects and disconnects only update the hash and queue the entry
+for a write-behind flush, which saves all pending LiveDocumentUser rows with
+one bulk_update every LIVE_USER_FLUSH_INTERVAL seconds. A connect only goes
+to the database when the user joins the document for the first time (or the
+cached hash expired); concurrent connects that find the hash empty share a
+single fill instead of each loading every row.
+"""
+import asyncio
+import json
+import logging
+import random
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from document.models import LiveDocumentUser, USER_COLORS
+from utils.redis_key_generator import get_key_for_document_live_users
+
+logger = logging.getLogger(__name__)
+
+# marks a hash that holds every row of the document, not just recent joins
+LOADED = "_loaded"
+
+
+def _entry(live_user):
+    return {
+        "id": live_user.id,
+        "user_id": live_user.user_id,
+        "name": live_user.name,
+        "email": live_user.email,
+        "color": live_user.color,
+        "is_online": live_user.is_online,
+    }
+
+
+@sync_to_async
+def _load_entries(document):
+    return [_entry(live_user) for live_user in LiveDocumentUser.objects.filter(document_id=document.id)]
+
+
+def _name(user):
+    return f'{user.first_name} {user.last_name}' or user.email
+
+
+@sync_to_async
+def _create_entries(document, users):
+    """get_or_create of the LiveDocumentUser rows of these users, in a fixed number of queries."""
+    users = {user.id: user for user in users}
+    existing = {
+        live_user.user_id: live_user
+        for live_user in LiveDocumentUser.objects.filter(document_id=document.id, user_id__in=users)
+    }
+    for live_user in existing.values():
+        user = users[live_user.user_id]
+        live_user.email = user.email
+        live_user.name = _name(user)
+        live_user.is_online = True
+    LiveDocumentUser.objects.bulk_update(existing.values(), ["email", "name", "is_online"])
+
+    LiveDocumentUser.objects.bulk_create(
+        [
+            LiveDocumentUser(
+                document_id=document.id,
+                user=user,
+                email=user.email,
+                name=_name(user),
+                color=random.choice(USER_COLORS),
+                is_online=True,
+            )
+            for user in users.values() if user.id not in existing
+        ],
+        ignore_conflicts=True,  # created by another worker meanwhile
+    )
+    return {
+        live_user.user_id: _entry(live_user)
+        for live_user in LiveDocumentUser.objects.filter(document_id=document.id, user_id__in=users)
+    }
+
+
+# share token -> {user id: (user, future of their entry)} of first joins not yet
+# sent to the database; they go in one batch once the running one is done
+_creates = {}
+
+
+async def _create_entry(document, user):
+    batch = _creates.get(document.share_token)
+    if batch is None:
+        batch = _creates[document.share_token] = {}
+        asyncio.ensure_future(_create_batch(document, batch))
+    if user.id not in batch:
+        batch[user.id] = (user, asyncio.get_running_loop().create_future())
+    return dict(await asyncio.shield(batch[user.id][1]))
+
+
+async def _create_batch(document, batch):
+    await asyncio.sleep(0)  # let the joiners of this tick queue up
+    del _creates[document.share_token]
+    try:
+        entries = await _create_entries(document, [user for user, _ in batch.values()])
+    except Exception as e:
+        for _, future in batch.values():
+            future.set_exception(e)
+    else:
+        for user_id, (_, future) in batch.items():
+            future.set_result(entries[user_id])
+
+
+# share token -> the running fill of its hash, awaited by every concurrent joiner
+_fills = {}
+
+
+def _decode(stored):
+    return {field.decode(): json.loads(value) for field, value in stored.items() if field != LOADED.encode()}
+
+
+async def _fill(redis, key, document):
+    stored = await redis.hgetall(key)
+    if LOADED.encode() in stored:
+        return _decode(stored)  # filled meanwhile, e.g. by another worker
+
+    entries = {str(entry["user_id"]): entry for entry in await _load_entries(document)}
+    async with redis.pipeline(transaction=True) as pipe:
+        # HSETNX keeps entries a join on another worker wrote meanwhile
+        for field, entry in entries.items():
+            pipe.hsetnx(key, field, json.dumps(entry))
+        pipe.hset(key, LOADED, "1")
+        pipe.expire(key, settings.LIVE_USERS_CACHE_TTL)
+        await pipe.execute()
+    return entries
+
+
+async def _entries(redis, key, document):
+    stored = await redis.hgetall(key)
+    if LOADED.encode() in stored:
+        return _decode(stored)
+
+    fill = _fills.get(document.share_token)
+    if fill is None:
+        fill = _fills[document.share_token] = asyncio.ensure_future(_fill(redis, key, document))
+        fill.add_done_callback(lambda _: _fills.pop(document.share_token, None))
+    # a joiner that times out must not cancel the fill the others wait for
+    entries = await asyncio.shield(fill)
+    return {field: dict(entry) for field, entry in entries.items()}
+
+
+async def join(redis, document, user):
+    """
+    Mark a user online in a document. Returns (their entry, all entries of
+    the document) with the user's entry included.
+    """
+    key = get_key_for_document_live_users(document.share_token)
+    entries = await _entries(redis, key, document)
+
+    entry = entries.get(str(user.id))
+    if entry is None:
+        # first time in this document
+        entry = await _create_entry(document, user)
+    else:
+        entry.update(
+            email=user.email,
+            name=_name(user),
+            is_online=True,
+        )
+        _queue_write(entry)
+    entries[str(user.id)] = entry
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key, str(user.id), json.dumps(entry))
+        pipe.expire(key, settings.LIVE_USERS_CACHE_TTL)
+        await pipe.execute()
+
+    return entry, list(entries.values())
+
+
+async def leave(redis, share_token, entry):
+    """Mark a user offline, given the entry join() returned."""
+    entry = dict(entry, is_online=False)
+    await redis.hset(get_key_for_document_live_users(share_token), str(entry["user_id"]), json.dumps(entry))
+    _queue_write(entry)
+
+
+async def mark_offline(redis, share_token, user_id):
+    """Mark a user offline in the cache only, for callers that update the database themselves."""
+    key = get_key_for_document_live_users(share_token)
+    value = await redis.hget(key, str(user_id))
+    if value is not None:
+        await redis.hset(key, str(user_id), json.dumps(dict(json.loads(value), is_online=False)))
+
+
+# LiveDocumentUser id -> latest entry not yet saved
+_pending = {}
+_flusher = None
+
+
+def _queue_write(entry):
+    _pending[entry["id"]] = entry
+    _schedule_flush()
+
+
+def _schedule_flush():
+    global _flusher
+    if _flusher is None:
+        _flusher = asyncio.create_task(_flush_later())
+
+
+async def _flush_later():
+    global _flusher
+    await asyncio.sleep(settings.LIVE_USER_FLUSH_INTERVAL)
+    _flusher = None
+    await flush()
+
+
+async def flush():
+    global _pending
+    pending, _pending = _pending, {}
+    if not pending:
+        return
+    try:
+        await _save_entries(list(pending.values()))
+    except Exception:
+        logger.exception("Could not save %d live users", len(pending))
+        # keep them for the next round, unless a newer state was queued meanwhile
+        for id_, entry in pending.items():
+            _pending.setdefault(id_, entry)
+        _schedule_flush()
+
+
+@sync_to_async
+def _save_entries(entries):
+    LiveDocumentUser.objects.bulk_update(
+        [
+            LiveDocumentUser(id=entry["id"], name=entry["name"], email=entry["email"], is_online=entry["is_online"])
+            for entry in entries
+        ],
+        ["name", "email", "is_online"],
+    )
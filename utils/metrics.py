@@ -0,0 +1,132 @@
+"""
+Process-local counters, gauges and histograms for the realtime paths.
+
+Metrics are created on first use and identified by name plus labels:
+
+    counter("yjs_frames_out_total").inc()
+    histogram("yjs_coalesce_delay_seconds").observe(0.012)
+
+Everything lives in memory of the current worker; collect() returns a
+snapshot of all of them.
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry = {}
+_lock = threading.Lock()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative[bound] = total
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+def _get(cls, name, labels, **kwargs):
+    key = (name, tuple(sorted(labels.items())))
+    metric = _registry.get(key)
+    if metric is None:
+        with _lock:
+            metric = _registry.get(key)
+            if metric is None:
+                metric = _registry[key] = cls(**kwargs)
+    return metric
+
+
+def counter(name, **labels):
+    return _get(Counter, name, labels)
+
+
+def gauge(name, **labels):
+    return _get(Gauge, name, labels)
+
+
+def histogram(name, buckets=DEFAULT_BUCKETS, **labels):
+    return _get(Histogram, name, labels, buckets=buckets)
+
+
+def collect():
+    """All metrics of this process as a list of (name, labels, kind, value)."""
+    return [
+        (name, dict(labels), metric.kind, metric.snapshot())
+        for (name, labels), metric in sorted(_registry.items(), key=lambda item: item[0])
+    ]
+
+
+def _format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def render_prometheus():
+    """collect() in the Prometheus text exposition format."""
+    lines, typed = [], set()
+    for name, labels, kind, value in collect():
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+        if kind != "histogram":
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+            continue
+        for bound, count in value["buckets"].items():
+            lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {value['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
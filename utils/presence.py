@@ -0,0 +1,117 @@
+"""
+Presence of users in live documents, kept in Redis.
+
+A document's members are a set of user ids (get_key_for_document) plus one
+hash per member with their details (get_key_for_document_user). join() and
+leave() are each a single MULTI/EXEC pipeline, so a join and a concurrent
+leave can't interleave and the count leave() returns always matches what is
+stored.
+
+Presence does not rely on clean disconnects: every entry has a deadline in
+a sorted set (get_key_for_presence_deadlines) that the connection pushes
+forward with heartbeat(). Entries whose worker died stop being renewed, and
+reap() removes them once their deadline passed. A heartbeat also re-asserts
+the whole entry, so one that was reaped while its heartbeat was late comes
+back on the next beat.
+
+Each user also has their open document sockets in a sorted set
+(get_key_for_user_sockets) with the same deadlines, so documents() can tell
+which live documents a user is in, e.g. for a reconnecting notification
+socket, and leave() how many of their sockets remain in the document.
+"""
+import time
+
+from django.conf import settings
+
+from utils.redis_key_generator import (
+    get_key_for_document, get_key_for_document_user, get_key_for_presence_deadlines, get_key_for_user_sockets,
+)
+
+
+def _entry(share_token, user_id):
+    return f"{share_token}:{user_id}"
+
+
+def _renew(pipe, share_token, user_id, details, channel_name):
+    deadline = time.time() + settings.PRESENCE_TTL
+    pipe.sadd(get_key_for_document(share_token), str(user_id))
+    pipe.hset(get_key_for_document_user(share_token, user_id), mapping=details)
+    # the hash outlives the deadline so the reaper can still say who left
+    pipe.expire(get_key_for_document_user(share_token, user_id), settings.PRESENCE_TTL * 2)
+    pipe.zadd(get_key_for_presence_deadlines(), {_entry(share_token, user_id): deadline})
+    pipe.zadd(get_key_for_user_sockets(user_id), {_entry(share_token, channel_name): deadline})
+    pipe.expire(get_key_for_user_sockets(user_id), settings.PRESENCE_TTL * 2)
+
+
+def _decode_sockets(sockets):
+    return [socket.decode().split(":", 1) for socket in sockets]
+
+
+async def join(redis, share_token, user_id, details, channel_name):
+    """Add a user's socket to a document."""
+    async with redis.pipeline(transaction=True) as pipe:
+        _renew(pipe, share_token, user_id, details, channel_name)
+        await pipe.execute()
+
+
+async def heartbeat(redis, share_token, user_id, details, channel_name):
+    """
+    Push a user's presence deadline forward by PRESENCE_TTL. Returns whether
+    the socket had been reaped meanwhile (and is now back).
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        _renew(pipe, share_token, user_id, details, channel_name)
+        *_, added, _ = await pipe.execute()
+    return bool(added)
+
+
+async def leave(redis, share_token, user_id, channel_name):
+    """
+    Remove a user's socket from a document. Returns (member count, the
+    user's sockets still open in the document) after the leave.
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zrem(get_key_for_presence_deadlines(), _entry(share_token, user_id))
+        pipe.srem(get_key_for_document(share_token), str(user_id))
+        pipe.delete(get_key_for_document_user(share_token, user_id))
+        pipe.zrem(get_key_for_user_sockets(user_id), _entry(share_token, channel_name))
+        pipe.scard(get_key_for_document(share_token))
+        pipe.zrangebyscore(get_key_for_user_sockets(user_id), time.time(), "+inf")
+        *_, count, sockets = await pipe.execute()
+    sockets = sum(1 for token, _ in _decode_sockets(sockets) if token == str(share_token))
+    return count, sockets
+
+
+async def documents(redis, user_id):
+    """Share tokens of the documents a user has a live socket in."""
+    sockets = await redis.zrangebyscore(get_key_for_user_sockets(user_id), time.time(), "+inf")
+    return {token for token, _ in _decode_sockets(sockets)}
+
+
+async def count(redis, share_token):
+    return await redis.scard(get_key_for_document(share_token))
+
+
+async def expired(redis, limit=100):
+    """Presence entries whose deadline passed, as (share_token, user_id) pairs."""
+    entries = await redis.zrangebyscore(get_key_for_presence_deadlines(), "-inf", time.time(), start=0, num=limit)
+    return [tuple(entry.decode().rsplit(":", 1)) for entry in entries]
+
+
+async def reap(redis, share_token, user_id):
+    """
+    Remove an expired entry. Returns the details of the user who left, or
+    None when another worker claimed the entry first.
+    """
+    # ZREM is the claim: only one reaper gets 1 back
+    if not await redis.zrem(get_key_for_presence_deadlines(), _entry(share_token, user_id)):
+        return None
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hgetall(get_key_for_document_user(share_token, user_id))
+        pipe.srem(get_key_for_document(share_token), str(user_id))
+        pipe.delete(get_key_for_document_user(share_token, user_id))
+        # the user's sockets whose worker died; a live one with a late heartbeat comes back on its next beat
+        pipe.zremrangebyscore(get_key_for_user_sockets(user_id), "-inf", time.time())
+        details, *_ = await pipe.execute()
+    return {key.decode(): value.decode() for key, value in details.items()}
@@ -0,0 +1,150 @@
+"""
+Pooled Redis clients shared by everything in the process.
+
+get_redis() is the sync client (REST views, serializers, the document cache)
+and get_async_redis() the asyncio one (consumers, presence, the Yjs relay).
+Both draw from a BlockingConnectionPool of at most REDIS_MAX_CONNECTIONS
+connections, created once under a lock, so a request or a handshake reuses an
+open, authenticated connection instead of paying for a new one. Asyncio
+connections can't cross event loops, so there is one async pool per loop.
+
+Every connection has REDIS_SOCKET_TIMEOUT / REDIS_CONNECT_TIMEOUT, is PINGed
+before use when it sat idle for REDIS_HEALTH_CHECK_INTERVAL seconds, and a
+caller waits at most REDIS_POOL_TIMEOUT seconds for a free one. Pool usage is
+recorded per pool ("sync" / "async"):
+
+- redis_pool_connections_in_use, redis_pool_max_connections
+- redis_pool_connections_created_total
+- redis_pool_exhausted_total: callers that got no connection in time
+
+ping() is the health check.
+"""
+import asyncio
+import threading
+import weakref
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+from utils import metrics
+
+_lock = threading.Lock()
+_sync_client = None
+_async_clients = weakref.WeakKeyDictionary()
+# set by use_clients(), e.g. to fakeredis in benchmarks and tests
+_override = None
+
+
+def _pool_kwargs():
+    return {
+        "max_connections": settings.REDIS_MAX_CONNECTIONS,
+        "timeout": settings.REDIS_POOL_TIMEOUT,
+        "socket_timeout": settings.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": settings.REDIS_CONNECT_TIMEOUT,
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+def _record_pool(name, max_connections):
+    metrics.gauge("redis_pool_max_connections", pool=name).set(max_connections)
+
+
+class _MeteredPool(redis.BlockingConnectionPool):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._checked_out = set()
+
+    def make_connection(self):
+        metrics.counter("redis_pool_connections_created_total", pool="sync").inc()
+        return super().make_connection()
+
+    def get_connection(self, *args, **kwargs):
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            if str(e) == "No connection available.":
+                metrics.counter("redis_pool_exhausted_total", pool="sync").inc()
+            raise
+        self._checked_out.add(connection)
+        metrics.gauge("redis_pool_connections_in_use", pool="sync").inc()
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        # the pool also releases connections it failed to hand out
+        if connection in self._checked_out:
+            self._checked_out.discard(connection)
+            metrics.gauge("redis_pool_connections_in_use", pool="sync").dec()
+
+
+class _AsyncMeteredPool(redis.asyncio.BlockingConnectionPool):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._checked_out = set()
+
+    def make_connection(self):
+        metrics.counter("redis_pool_connections_created_total", pool="async").inc()
+        return super().make_connection()
+
+    async def get_connection(self, *args, **kwargs):
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError as e:
+            if str(e) == "No connection available.":
+                metrics.counter("redis_pool_exhausted_total", pool="async").inc()
+            raise
+        self._checked_out.add(connection)
+        metrics.gauge("redis_pool_connections_in_use", pool="async").inc()
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        # the pool also releases connections it failed to hand out
+        if connection in self._checked_out:
+            self._checked_out.discard(connection)
+            metrics.gauge("redis_pool_connections_in_use", pool="async").dec()
+
+
+def get_redis():
+    """The sync client of this process."""
+    global _sync_client
+    if _override is not None:
+        return _override[0]
+    if _sync_client is None:
+        with _lock:
+            if _sync_client is None:
+                pool = _MeteredPool.from_url(settings.REDIS_URL, **_pool_kwargs())
+                _record_pool("sync", pool.max_connections)
+                _sync_client = redis.Redis(connection_pool=pool)
+    return _sync_client
+
+
+async def get_async_redis():
+    """The asyncio client of the running event loop."""
+    if _override is not None:
+        return _override[1]
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        with _lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                pool = _AsyncMeteredPool.from_url(settings.REDIS_URL, **_pool_kwargs())
+                _record_pool("async", pool.max_connections)
+                client = _async_clients[loop] = redis.asyncio.Redis(connection_pool=pool)
+    return client
+
+
+def use_clients(sync_client, async_client):
+    """Serve these two clients instead of the pooled ones; use_clients(None, None) goes back."""
+    global _override
+    _override = None if sync_client is None and async_client is None else (sync_client, async_client)
+
+
+def ping():
+    """Whether Redis answers a PING through the sync pool."""
+    try:
+        return bool(get_redis().ping())
+    except redis.RedisError:
+        return False
@@ -2,4 +2,42 @@ def get_key_for_document(share_token):
     """
     Generate a Redis key for a document based on its ID.
     """
-    return f"doc:{share_token}:users"
\ No newline at end of file
+    return f"doc:{share_token}:users"
+
+def get_channel_for_yjs_room(share_token):
+    """
+    Generate the Redis pub/sub channel relaying a Yjs room between workers.
+    """
+    return f"yjs:{share_token}"
+
+def get_key_for_document_user(share_token, user_id):
+    """
+    Generate the Redis key of the hash holding a live user's details in a document.
+    """
+    return f"doc:{share_token}:user:{user_id}"
+
+def get_key_for_presence_deadlines():
+    """
+    Generate the Redis key of the sorted set of "<share_token>:<user_id>" presence
+    entries, scored by the time they expire unless renewed by a heartbeat.
+    """
+    return "presence:deadlines"
+
+def get_key_for_user_sockets(user_id):
+    """
+    Generate the Redis key of the sorted set of a user's open "<share_token>:<channel_name>"
+    document sockets, scored by the time they expire unless renewed by a heartbeat.
+    """
+    return f"user:{user_id}:sockets"
+
+def get_key_for_document_live_users(share_token):
+    """
+    Generate the Redis key of the hash caching a document's LiveDocumentUser rows by user id.
+    """
+    return f"doc:{share_token}:live_users"
+
+def get_channel_for_document_invalidation():
+    """
+    Generate the Redis pub/sub channel announcing changed or deleted documents to every process.
+    """
+    return "documents:invalidate"
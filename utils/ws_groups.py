@@ -15,3 +15,8 @@ def generate_group_name_from_user_id(user_id):
 
     h = hmac.new(secret, message, hashlib.sha256).hexdigest()
     return f"user_{h}"
+
+
+def generate_document_counts_group_name(share_token):
+    # notification sockets of a document's live members join this for its member count
+    return f"doc_{share_token}_counts"